@@ -1,18 +1,1011 @@
+import base64
+import bisect
+import contextlib
+import csv
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import mmap
 import os
 import re
 import random
 import shutil
+import sqlite3
+import sys
+import time
+import multiprocessing
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed, wait)
 from typing import List, Tuple, Dict
 
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，不支持 reflink
+    fcntl = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # 可选依赖：未安装时不能从 PDF 内容读取金额
+    PdfReader = None
+
+# 精确算法的适用规模及搜索节点上限（超过上限则退回启发式算法）。
+# "auto" 使用更小的节点上限：未完成时仍返回与启发式算法结果中更好的一个，
+# 而有限的搜索使总用时保持很短
+EXACT_MAX_INVOICES = 60
+EXACT_MAX_PEOPLE = 6
+EXACT_MAX_NODES = 50000
+EXACT_AUTO_MAX_NODES = 5000
+
+# 人数不少于该值时贪心分配改用优先队列，每张发票从堆顶取出的候选人数
+GREEDY_HEAP_MIN_PEOPLE = 64
+GREEDY_HEAP_PROBE = 8
+
+# 模拟退火：未指定时间预算时每张发票的步数、初始温度（相对每人的平均得分项）
+# 和结束时温度的下降比例
+ANNEAL_STEPS_PER_INVOICE = 300
+ANNEAL_START_FACTOR = 0.1
+ANNEAL_END_RATIO = 1e-4
+
+# 启发式求解策略：方法名 -> InvoiceAllocator 的方法名
+SOLVER_STRATEGIES = {
+    "heuristic": "enhanced_min_deviation_allocation",
+    "anneal": "annealing_allocation",
+    "decompose": "decomposition_allocation",
+}
+
+# 分解算法：每个子问题的人数，以及有时间预算时子问题可用的时间比例
+DECOMPOSE_GROUP_PEOPLE = 16
+DECOMPOSE_SOLVE_SHARE = 0.8
+
+# 计算总得分下界时位集运算量的上限（发票数 × 最大上限分数）
+LOWER_BOUND_MAX_BITS = 20_000_000_000
+
+# 输出目录名（递归扫描时跳过）
+OUTPUT_DIR_NAME = "发票分配结果"
+
+# 控制台显示方案时列出全部发票的最大发票数，以及每人一行显示的最大人数；
+# 超过时只显示总体评估，完整方案写入报告文件。报告文件的写缓冲区大小（字节）和文件名
+REPORT_FULL_MAX_INVOICES = 500
+REPORT_PEOPLE_MAX = 100
+REPORT_BUFFER_BYTES = 1 << 20
+REPORT_FILE_NAME = "分配方案.csv"
+
+# 输出文件的生成方式及默认并发线程数
+OUTPUT_MODES = ("copy", "hardlink", "reflink")
+OUTPUT_WORKERS = 8
+
+# 计算文件哈希（重复发票检测、发票台账）的并发线程数和每个任务的文件数；
+# 不小于 HASH_MMAP_MIN_BYTES 的文件通过内存映射读取
+HASH_WORKERS = 8
+HASH_BATCH_SIZE = 256
+HASH_MMAP_MIN_BYTES = 1 << 20
+
+# Linux 上克隆文件（reflink）的 ioctl 请求号
+FICLONE = 0x40049409
+
+# 方案缓存的最大条数和总大小（字节）
+SOLUTION_CACHE_MAX_ENTRIES = 200
+SOLUTION_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+# 在线分配：预留池的发票张数、最终调整的最大轮数和监视文件夹的扫描间隔（秒）
+ONLINE_RESERVOIR_SIZE = 64
+ONLINE_POLISH_ROUNDS = 20
+ONLINE_POLL_INTERVAL = 2.0
+# 监视文件夹时记住的最近产生过的文件数（避免写入中的文件被重复产生）
+ONLINE_RECENT_FILES = 10000
+
+# 增强算法写入检查点的最小间隔（秒）
+CHECKPOINT_INTERVAL = 10
+
+# 文件名解析使用的正则表达式，只在模块加载时编译一次
+PDF_PATTERN = re.compile(r'\.pdf$', re.IGNORECASE)
+# 匹配人名后的第一个金额，忽略括号内的数字
+AMOUNT_PATTERN = re.compile(r'\s+(\d+\.?\d*)\s*(?:\(|\.pdf|$)')
+BRACKET_PATTERN = re.compile(r'\([^)]*\)')
+AMOUNT_FALLBACK_PATTERN = re.compile(r'(\d+\.?\d*)')
+# 文件名末尾的金额和可能的副本标记
+RENAME_AMOUNT_PATTERN = re.compile(r'(\d+\.?\d*)\s*(?:\(\d+\))?$')
+
+# 发票正文中的价税合计金额，按优先级排列
+CONTENT_TOTAL_PATTERNS = [
+    re.compile(r'[（(]\s*小写\s*[）)]\s*[¥￥]?\s*([\d,]+\.\d{1,2})'),
+    re.compile(r'价税合计[^¥￥\d]*[¥￥]\s*([\d,]+\.\d{1,2})'),
+    re.compile(r'(?:合计|总计|(?<![A-Za-z])Total)[^¥￥\d]*[¥￥]\s*([\d,]+\.\d{1,2})', re.IGNORECASE),
+]
+CONTENT_YUAN_PATTERN = re.compile(r'[¥￥]\s*([\d,]+\.\d{1,2})')
+
+
+def to_cents(amount) -> int:
+    """将金额（元）转换为整数分"""
+    return int(round(amount * 100))
+
+
+def subset_sum_bits(cents, cap):
+    """所有不超过 cap 分的子集和组成的位集（第 k 位为 1 表示 k 分可达）"""
+    mask = (1 << (cap + 1)) - 1
+    bits = 1
+    for c in cents:
+        bits = (bits | (bits << c)) & mask
+    return bits
+
+
+def reachable_totals(reach, current, target, low, high):
+    """已有 current 分时，借助位集 reach 中的子集和能达到的、落在 [low, high]
+    内且最接近 target 的总额：至多返回目标两侧各一个值（单位均为分）"""
+    hi = high - current
+    if hi < 0:
+        return []
+    lo = max(0, low - current)
+    t = target - current
+    totals = []
+    # 不超过目标的最大可达值
+    if t >= lo:
+        below = reach & ((1 << (min(t, hi) + 1)) - 1)
+        s = below.bit_length() - 1
+        if s >= lo:
+            totals.append(current + s)
+    # 不低于目标的最小可达值
+    start = max(t, lo)
+    if start <= hi:
+        above = reach >> start
+        if above:
+            s = start + (above & -above).bit_length() - 1
+            if s <= hi:
+                totals.append(current + s)
+    return totals
+
+
+def window_reachable(reach, low, high):
+    """位集 reach 中是否有落在 [low, high] 内的子集和"""
+    return low <= high and (reach >> low) & ((1 << (high - low + 1)) - 1) != 0
+
+
+def blocked_amounts(reach, low, high, amounts):
+    """有序金额列表 amounts 中不可能出现在总额落在 [low, high] 内的子集中的金额（分）
+
+    金额 c 能出现在这样的子集中的必要条件是 reach 中存在子集和
+    s ∈ [low - c, high - c]。reach 在 [full_from, high] 内全部可达时，
+    c <= high - full_from 的金额必然满足条件，只需逐个检查更大的金额。
+    """
+    zeros = ~reach & ((1 << (high + 1)) - 1)
+    full_from = zeros.bit_length()
+    blocked = set()
+    for c in amounts[bisect.bisect_right(amounts, high - full_from):]:
+        if c > high or not window_reachable(reach, max(0, low - c), high - c):
+            blocked.add(c)
+    return blocked
+
+
+class InvoiceList(Sequence):
+    """紧凑的发票列表
+
+    文件名驻留后保存在列表中，金额以整数分保存在 array('q') 中。
+    按下标或迭代访问时返回 (文件名, 金额) 元组，与原先的列表用法兼容。
+    """
+    
+    __slots__ = ("names", "cents")
+    
+    def __init__(self, invoices=()):
+        self.names = []
+        self.cents = array('q')
+        for filename, amount in invoices:
+            self.append((filename, amount))
+    
+    def __len__(self):
+        return len(self.cents)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.names[index], self.cents[index] / 100
+    
+    def append(self, invoice):
+        """添加一张发票 (文件名, 金额)"""
+        filename, amount = invoice
+        self.names.append(sys.intern(filename))
+        self.cents.append(to_cents(amount))
+    
+    def total(self):
+        """发票总金额（元）"""
+        return sum(self.cents) / 100
+
+
+def iter_pdf_files(folder_path, recursive=False, change_time=False):
+    """用 os.scandir 流式遍历 PDF 文件，产生 (相对路径, 大小, 修改时间纳秒)
+
+    change_time 为 True 时第三项改为状态改变时间 st_ctime_ns：文件被移动、
+    重命名或复制进来时都会更新，而修改时间可能保留原来的值。
+    """
+    stack = [""]
+    while stack:
+        relative_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(folder_path, relative_dir)) as entries:
+                for entry in entries:
+                    relpath = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and entry.name != OUTPUT_DIR_NAME:
+                                stack.append(relpath)
+                        elif PDF_PATTERN.search(entry.name):
+                            stat = entry.stat()
+                            yield (relpath, stat.st_size,
+                                   stat.st_ctime_ns if change_time else stat.st_mtime_ns)
+                    except OSError as e:
+                        print(f"警告：无法读取 '{relpath}': {str(e)}")
+        except OSError as e:
+            print(f"警告：无法读取文件夹 '{relative_dir or folder_path}': {str(e)}")
+
+
+class ScanCache:
+    """扫描结果的持久缓存
+
+    以 (相对路径, 大小, 修改时间) 为键保存从文件名解析出的金额，存放在
+    用户缓存目录中，每个扫描文件夹一个 JSON 文件。保存时丢弃本次扫描
+    未出现的文件。
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.seen = {}
+        self.dirty = False
+        self.entries = read_json(path, {})
+    
+    @classmethod
+    def for_folder(cls, folder_path):
+        """返回某个扫描文件夹对应的缓存"""
+        digest = hashlib.sha1(os.path.abspath(folder_path).encode("utf-8")).hexdigest()
+        return cls(os.path.join(cache_dir(), f"scan-{digest}.json"))
+    
+    def get(self, relpath, size, mtime):
+        """返回 (是否命中, 金额)"""
+        entry = self.entries.get(relpath)
+        if entry is not None and entry[0] == size and entry[1] == mtime:
+            self.seen[relpath] = entry
+            return True, entry[2]
+        return False, None
+    
+    def put(self, relpath, size, mtime, amount):
+        self.seen[relpath] = [size, mtime, amount]
+        self.dirty = True
+    
+    def save(self):
+        """写回缓存（先写临时文件再替换，避免中断时损坏）"""
+        if not self.dirty and len(self.seen) == len(self.entries):
+            return
+        try:
+            write_json_atomic(self.path, self.seen)
+        except OSError as e:
+            print(f"警告：无法写入扫描缓存: {str(e)}")
+
+
+class ContentCache:
+    """发票内容金额的持久缓存
+
+    以文件内容的 SHA-256 为键，文件改名或移动后仍能命中，因此每个 PDF
+    只需解析一次。未能读出金额的文件也会记录（值为 None）。
+    """
+    
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), "content-amounts.json")
+        self.entries = read_json(self.path, {})
+        self.dirty = False
+    
+    def get(self, digest):
+        """返回 (是否命中, 金额)"""
+        if digest in self.entries:
+            return True, self.entries[digest]
+        return False, None
+    
+    def put(self, digest, amount):
+        self.entries[digest] = amount
+        self.dirty = True
+    
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            write_json_atomic(self.path, self.entries)
+        except OSError as e:
+            print(f"警告：无法写入发票内容缓存: {str(e)}")
+
+
+class InvoiceLedger:
+    """已分配发票的台账（SQLite）
+
+    每张分配过的发票记录一行：内容哈希（主键）、文件大小、金额（分）、
+    原文件名、分配批次和人员。扫描时先按文件大小（有索引）找出可能分配
+    过的文件，只对这些文件计算哈希，再按主键查询，因此历史记录达到
+    数百万行时仍然很快。一次分配的全部结果按哈希排序后在一个事务中批量
+    写入；哈希以 32 字节二进制保存，使主键索引更小。
+    """
+    
+    # 单条 SQL 中 IN (...) 的参数个数上限
+    QUERY_CHUNK = 500
+    
+    def __init__(self, path=None):
+        self.path = path or os.path.join(data_dir(), "ledger.sqlite3")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA cache_size=-65536")  # 64 MB
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY,
+                    created TEXT NOT NULL,
+                    folder TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS invoices (
+                    hash BLOB PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    cents INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    run_id INTEGER NOT NULL REFERENCES runs(id),
+                    person TEXT NOT NULL
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS invoices_size ON invoices(size);
+                CREATE INDEX IF NOT EXISTS invoices_run ON invoices(run_id);
+            """)
+    
+    def _query(self, sql, values):
+        """对 values 分批执行 IN 查询，返回第一列的集合"""
+        values = list(values)
+        found = set()
+        for i in range(0, len(values), self.QUERY_CHUNK):
+            chunk = values[i:i + self.QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(row[0] for row in
+                         self.connection.execute(sql.format(placeholders), chunk))
+        return found
+    
+    def known_sizes(self, sizes):
+        """返回 sizes 中台账里出现过的文件大小"""
+        return self._query("SELECT DISTINCT size FROM invoices WHERE size IN ({})", set(sizes))
+    
+    def allocated(self, hashes):
+        """返回 hashes 中已经分配过的内容哈希"""
+        found = self._query("SELECT hash FROM invoices WHERE hash IN ({})",
+                            {bytes.fromhex(digest) for digest in hashes})
+        return {digest.hex() for digest in found}
+    
+    def record_run(self, folder, rows):
+        """在一个事务中写入一次分配的结果，返回批次编号
+
+        rows: [(十六进制哈希, 文件大小, 金额（分）, 文件名, 人员), ...]
+        """
+        rows = sorted((bytes.fromhex(digest), size, cents, filename, person)
+                      for digest, size, cents, filename, person in rows)
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (created, folder) VALUES (?, ?)",
+                (time.strftime("%Y-%m-%d %H:%M:%S"), os.path.abspath(folder)))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO invoices (hash, size, cents, filename, run_id, person) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((digest, size, cents, filename, run_id, person)
+                 for digest, size, cents, filename, person in rows))
+        return run_id
+    
+    def remove_run(self, run_id):
+        """撤销一次分配，其中的发票在之后的扫描中重新可用"""
+        with self.connection:
+            self.connection.execute("DELETE FROM invoices WHERE run_id = ?", (run_id,))
+            self.connection.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+    
+    def close(self):
+        self.connection.close()
+
+
+class SolutionCache:
+    """分配方案的持久缓存
+
+    以问题的规范指纹（从小到大排序的发票金额、各人额度及上下限、求解
+    参数）为键，每个方案一个 JSON 文件，保存规范顺序下的分配向量，
+    因此与文件名无关。命中时更新文件的修改时间，条数或总大小超过上限时
+    删除最久未使用的方案（LRU）。
+    """
+    
+    def __init__(self, path=None, max_entries=SOLUTION_CACHE_MAX_ENTRIES,
+                 max_bytes=SOLUTION_CACHE_MAX_BYTES):
+        self.path = path or os.path.join(cache_dir(), "solutions")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+    
+    @staticmethod
+    def fingerprint(cents, bounds, lower_bound, upper_bound, settings):
+        """问题的规范指纹：cents 须已排序，bounds 为每人的 (目标, 下限, 上限)"""
+        data = [list(cents), [list(b) for b in bounds], repr(lower_bound), repr(upper_bound),
+                settings]
+        return hashlib.sha256(json.dumps(data).encode("utf-8")).hexdigest()
+    
+    def entry_path(self, key):
+        return os.path.join(self.path, f"{key}.json")
+    
+    def get(self, key):
+        """返回缓存的分配向量，未命中时返回 None"""
+        path = self.entry_path(key)
+        assignment = read_json(path, None)
+        if assignment is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return assignment
+    
+    def put(self, key, assignment):
+        try:
+            write_json_atomic(self.entry_path(key), list(assignment))
+            self.evict()
+        except OSError as e:
+            print(f"警告：无法写入方案缓存: {str(e)}")
+    
+    def evict(self):
+        """条数或总大小超过上限时，按最近使用时间删除最旧的方案"""
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, path = entries.pop(0)
+            os.remove(path)
+            total -= size
+
+
+class RestartCheckpoint:
+    """增强算法的检查点
+
+    第 i 次迭代的随机数只由 (种子, i) 决定，因此保存种子、已连续完成的
+    迭代数和目前的最佳方案（得分、所在迭代、分配向量）就足以从中断处
+    继续，继续运行的结果与不中断时相同。每次迭代后只更新内存中的状态，
+    距上次写入超过 CHECKPOINT_INTERVAL 秒才写入磁盘。
+    """
+    
+    def __init__(self, path, seed):
+        self.path = path
+        self.seed = seed
+        self.done = 0  # 编号小于 done 的迭代均已完成
+        self.finished = set()  # 编号不小于 done 的已完成迭代（并行时可能乱序完成）
+        self.best = None  # (得分, 迭代编号, 分配向量)
+        self.interrupted = False
+        self.saved_at = time.monotonic()
+    
+    @classmethod
+    def load(cls, path):
+        """读取检查点，不存在或已损坏时返回 None"""
+        data = read_json(path, None)
+        if not data:
+            return None
+        try:
+            checkpoint = cls(path, data["seed"])
+            checkpoint.done = data["done"]
+            if data["best"] is not None:
+                score, iteration, packed = data["best"]
+                assignment = array('i')
+                assignment.frombytes(base64.b64decode(packed))
+                checkpoint.best = (score, iteration, assignment)
+        except (KeyError, TypeError, ValueError):
+            return None
+        return checkpoint
+    
+    def update(self, iteration, assignment, score, valid):
+        """记录一次完成的迭代，到达写入间隔时保存"""
+        self.finished.add(iteration)
+        while self.done in self.finished:
+            self.finished.remove(self.done)
+            self.done += 1
+        # 与按迭代顺序汇总的选择一致：得分相同时取编号较小的迭代
+        if valid and (self.best is None or (score, iteration) < self.best[:2]):
+            self.best = (score, iteration, assignment)
+        if time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL:
+            self.save()
+    
+    def save(self):
+        best = None
+        if self.best is not None:
+            score, iteration, assignment = self.best
+            best = [score, iteration, base64.b64encode(assignment.tobytes()).decode("ascii")]
+        try:
+            write_json_atomic(self.path, {"seed": self.seed, "done": self.done, "best": best})
+        except OSError as e:
+            print(f"警告：无法写入检查点: {str(e)}")
+        self.saved_at = time.monotonic()
+    
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def cache_dir():
+    """本工具的缓存目录"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "InvoiceAllocator")
+
+
+def data_dir():
+    """本工具的数据目录（保存发票台账等需要长期保留的数据）"""
+    base = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "InvoiceAllocator")
+
+
+def read_json(path, default):
+    """读取 JSON 文件，不存在或已损坏时返回 default"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_atomic(path, data):
+    """先写临时文件再替换，避免中断时损坏原文件"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path):
+    """计算文件内容的 SHA-256
+
+    大文件通过内存映射读取，不复制数据；小文件建立映射的开销比直接读取
+    更大，一次读入。哈希计算期间释放 GIL，可以在线程池中并行。
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < HASH_MMAP_MIN_BYTES:
+            return hashlib.sha256(f.read()).hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+
+def _content_digest(path):
+    """计算文件哈希，文件无法读取时返回 None
+
+    在 hash_files 的线程池和读取发票内容时的进程池中运行，因此定义在模块级。
+    """
+    try:
+        return file_sha256(path)
+    except OSError as e:
+        print(f"警告：无法读取 '{path}': {str(e)}")
+        return None
+
+
+def hash_files(paths, workers=HASH_WORKERS):
+    """在线程池中计算文件的 SHA-256，返回与 paths 对应的列表（读取失败为 None）
+
+    每个任务处理一批文件，避免为每个小文件单独提交任务。
+    """
+    batches = [paths[i:i + HASH_BATCH_SIZE] for i in range(0, len(paths), HASH_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda batch: [_content_digest(path) for path in batch], batches)
+        return [digest for batch in results for digest in batch]
+
+
+def find_duplicate_files(folder_path, filenames, workers=HASH_WORKERS):
+    """找出内容完全相同的文件，返回 {重复文件: 保留的文件}
+
+    内容相同的文件大小必然相同，因此先按文件大小分组，只对同组有多个
+    文件的才在线程池中计算哈希。每组重复文件保留 filenames 中最靠前的一个。
+    """
+    by_size = {}
+    for filename in filenames:
+        try:
+            size = os.path.getsize(os.path.join(folder_path, filename))
+        except OSError:
+            continue
+        by_size.setdefault(size, []).append(filename)
+    candidates = [filename for group in by_size.values() if len(group) > 1 for filename in group]
+    if not candidates:
+        return {}
+    
+    digests = hash_files([os.path.join(folder_path, f) for f in candidates], workers)
+    # candidates 按大小分组排列，组内保持 filenames 中的顺序
+    kept = {}
+    duplicates = {}
+    for filename, digest in zip(candidates, digests):
+        if digest is None:
+            continue
+        if digest in kept:
+            duplicates[filename] = kept[digest]
+        else:
+            kept[digest] = filename
+    return duplicates
+
+
+def unique_filename(filename, used_names):
+    """在 used_names 中已有同名文件时追加序号，返回未使用的文件名并记录"""
+    candidate = filename
+    stem, ext = os.path.splitext(filename)
+    counter = 2
+    while candidate in used_names:
+        candidate = f"{stem} ({counter}){ext}"
+        counter += 1
+    used_names.add(candidate)
+    return candidate
+
+
+def reflink_file(source, dest):
+    """用写时复制克隆文件（Btrfs、XFS 等），不支持时返回 False"""
+    if fcntl is None:
+        return False
+    try:
+        with open(source, "rb") as src, open(dest, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, dest)
+        return True
+    except OSError:
+        return False
+
+
+def materialize_file(source, dest, mode="copy"):
+    """按指定方式生成目标文件，返回 (实际使用的方式, 文件大小)
+
+    硬链接或克隆失败（跨磁盘、文件系统不支持等）时退回复制。
+    已存在的目标文件先删除，避免通过上一次生成的硬链接改写源文件。
+    """
+    size = os.path.getsize(source)
+    if os.path.lexists(dest):
+        os.remove(dest)
+    if mode == "hardlink":
+        try:
+            os.link(source, dest)
+            return "hardlink", size
+        except OSError:
+            pass
+    elif mode == "reflink" and reflink_file(source, dest):
+        return "reflink", size
+    shutil.copy2(source, dest)
+    return "copy", size
+
+
+def parse_invoice_total(text):
+    """从发票文本中找出价税合计金额，找不到时返回 None"""
+    for pattern in CONTENT_TOTAL_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return float(match.group(1).replace(",", ""))
+    # 备用方案：取所有带人民币符号的金额中最大的一个
+    amounts = [float(m.replace(",", "")) for m in CONTENT_YUAN_PATTERN.findall(text)]
+    return max(amounts) if amounts else None
+
+
+def extract_amount_from_pdf(path):
+    """从 PDF 文本层读取发票金额（需要 pypdf），无法读取时返回 None"""
+    if PdfReader is None:
+        return None
+    try:
+        reader = PdfReader(path)
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception:
+        return None
+    return parse_invoice_total(text)
+
+
+class SolverStats:
+    """求解过程的统计信息
+
+    记录各阶段用时、计数器（得分计算次数、评估的人对、执行的移动/交换等）
+    和最佳得分随时间的变化。callback(event, data) 在以下事件发生时被调用：
+    "phase"（阶段结束）、"progress"（完成一次迭代）、"best"（发现更好方案）。
+    分配器的 stats 为 None 时不做任何统计。
+    """
+    
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self.trace = []
+    
+    def __getstate__(self):
+        # 回调函数不一定能序列化，工作进程中不需要
+        state = self.__dict__.copy()
+        state["callback"] = None
+        return state
+    
+    def elapsed(self):
+        return time.perf_counter() - self.start
+    
+    def emit(self, event, **data):
+        if self.callback is not None:
+            self.callback(event, data)
+    
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+    
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        """统计一个阶段的用时（同名阶段累加）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.add_time(name, seconds)
+            self.emit("phase", phase=name, seconds=seconds)
+    
+    def best(self, score, source, iteration=None):
+        """记录一次最佳得分的改进"""
+        elapsed = self.elapsed()
+        self.trace.append((elapsed, score, source))
+        self.emit("best", score=score, elapsed=elapsed, source=source, iteration=iteration)
+    
+    def take(self):
+        """取出并清空计数器和阶段用时（用于汇总工作进程的统计）"""
+        data = {"counters": self.counters, "phases": self.phases}
+        self.counters = {}
+        self.phases = {}
+        return data
+    
+    def merge(self, data):
+        for name, n in data["counters"].items():
+            self.count(name, n)
+        for phase, seconds in data["phases"].items():
+            self.add_time(phase, seconds)
+    
+    def to_dict(self):
+        return {
+            "elapsed": self.elapsed(),
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+            "trace": [{"elapsed": t, "score": s, "source": source}
+                      for t, s, source in self.trace],
+        }
+    
+    def save(self, path):
+        """导出为 JSON 文件"""
+        write_json_atomic(path, self.to_dict())
+
+
+# 进程池工作进程中的分配器及共享的提前终止迭代编号
+_worker_allocator = None
+_worker_cutoff = None
+
+
+def _init_restart_worker(allocator, cutoff):
+    """进程池初始化：每个工作进程只接收一次分配器数据"""
+    global _worker_allocator, _worker_cutoff
+    if allocator.stats is not None:
+        # 工作进程只累计计数，由主进程汇总并触发回调
+        allocator.stats = SolverStats()
+    _worker_allocator = allocator
+    _worker_cutoff = cutoff
+
+
+def _restart_worker(iteration, seed, stop_score, deadline=None):
+    """在工作进程中执行一次迭代"""
+    if _worker_cutoff.value < iteration:
+        return None
+    result = _worker_allocator.run_restart(iteration, seed, _worker_cutoff, deadline)
+    if result is None:
+        return None
+    assignment, totals, score, valid = result
+    if valid and score <= stop_score:
+        with _worker_cutoff.get_lock():
+            if iteration < _worker_cutoff.value:
+                _worker_cutoff.value = iteration
+    # 启用统计时附带本次迭代的计数，由主进程汇总
+    stats = _worker_allocator.stats.take() if _worker_allocator.stats is not None else None
+    return iteration, assignment, totals, score, valid, stats
+
+
+def _solve_subproblem(allocator, seed, deadline=None):
+    """求解分解后的一个子问题（可在工作进程中运行），返回 [(原发票下标, 子问题人员下标)]"""
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        allocation, _ = allocator.enhanced_min_deviation_allocation(seed=seed, deadline=deadline)
+    return [(int(filename), p) for p, name in enumerate(allocator.allocations)
+            for filename, _ in allocation[name]]
+
+
+class OnlineAllocator:
+    """在线分配器：发票逐张到达时立即分配
+
+    只保存每人的当前金额，以及金额最小的 reservoir_size 张发票组成的预留池
+    （小额发票最适合最后的微调）。新发票比预留池中最大的一张小时与之交换，
+    被换出的发票立即分配：在上限余量足够的人中选使得分下降最多的一个
+    （人数较多时只比较缺口最大的 GREEDY_HEAP_PROBE 个人），没有人的得分能
+    下降时不分配。与模拟退火相同，得分项由 range_score 计算，低于下限者
+    总比下限处更差。已分配的发票不再改变，内存占用与发票总数无关。
+    finish() 把预留池中的发票贪心分配后，做有限轮次的移动调整。
+    """
+    
+    def __init__(self, allocator, reservoir_size=ONLINE_RESERVOIR_SIZE):
+        self.allocator = allocator
+        self.names = list(allocator.allocations)
+        self.quotas = list(allocator.allocations.values())
+        bounds = [allocator.get_bounds_cents(quota) for quota in self.quotas]
+        self.targets = [target for target, _, _ in bounds]
+        self.lows = [low for _, low, _ in bounds]
+        self.highs = [high for _, _, high in bounds]
+        self.totals = [0] * len(self.names)
+        self.counts = [0] * len(self.names)
+        self.terms = [self.score(p, 0) for p in range(len(self.names))]
+        # 缺口最大的人在堆顶，键为 (当前金额 - 额度)
+        self.heap = [(-target, p) for p, target in enumerate(self.targets)]
+        heapq.heapify(self.heap)
+        self.probe = len(self.names) if len(self.names) < GREEDY_HEAP_MIN_PEOPLE else GREEDY_HEAP_PROBE
+        self.reservoir_size = reservoir_size
+        self.reservoir = []  # 最大堆 (-金额（分）, 序号, 文件名)
+        self.counter = itertools.count()
+        self.unused = 0
+    
+    def score(self, p, total):
+        return self.allocator.range_score(total, self.quotas[p], self.lows[p], self.highs[p])
+    
+    def choose(self, amount):
+        """返回接收 amount（分）后得分下降最多的人，没有时返回 -1"""
+        popped = []
+        eligible = 0
+        best_person = -1
+        best_delta = 0
+        while self.heap and eligible < self.probe:
+            _, p = heapq.heappop(self.heap)
+            popped.append(p)
+            if self.totals[p] + amount <= self.highs[p]:
+                eligible += 1
+                delta = self.score(p, self.totals[p] + amount) - self.terms[p]
+                if delta < best_delta:
+                    best_delta = delta
+                    best_person = p
+        if best_person >= 0:
+            self.place(best_person, amount, 1)
+        for p in popped:
+            heapq.heappush(self.heap, (self.totals[p] - self.targets[p], p))
+        return best_person
+    
+    def place(self, p, amount, count):
+        self.totals[p] += amount
+        self.counts[p] += count
+        self.terms[p] = self.score(p, self.totals[p])
+    
+    def add(self, filename, amount):
+        """处理一张新发票，返回本次确定的 [(文件名, 金额, 人名或 None)]"""
+        cents = to_cents(amount)
+        if len(self.reservoir) < self.reservoir_size:
+            heapq.heappush(self.reservoir, (-cents, next(self.counter), filename))
+            return []
+        if cents < -self.reservoir[0][0]:
+            negative, _, evicted = heapq.heapreplace(
+                self.reservoir, (-cents, next(self.counter), filename))
+            filename, cents = evicted, -negative
+        p = self.choose(cents)
+        if p < 0:
+            self.unused += 1
+        return [(filename, cents / 100, self.names[p] if p >= 0 else None)]
+    
+    def finish(self, polish_rounds=ONLINE_POLISH_ROUNDS):
+        """分配预留池中的发票并调整，返回其 [(文件名, 金额, 人名或 None)]
+
+        先按金额从大到小贪心分配，再逐轮把每张预留发票移到使总得分下降
+        最多的人（或不分配），没有改进或达到 polish_rounds 轮时结束。
+        """
+        items = sorted(((-negative, filename) for negative, _, filename in self.reservoir),
+                       reverse=True)
+        self.reservoir = []
+        owners = [self.choose(cents) for cents, _ in items]
+        
+        for _ in range(polish_rounds):
+            improved = False
+            for i, (cents, _) in enumerate(items):
+                src = owners[i]
+                # 从原持有者移出后的得分变化（未分配时为 0）
+                removal = self.score(src, self.totals[src] - cents) - self.terms[src] if src >= 0 else 0
+                best_change = removal if src >= 0 else 0
+                best_person = -1
+                for p in range(len(self.names)):
+                    if p == src or self.totals[p] + cents > self.highs[p]:
+                        continue
+                    change = removal + self.score(p, self.totals[p] + cents) - self.terms[p]
+                    if change < best_change - 1e-9:
+                        best_change = change
+                        best_person = p
+                if best_change < -1e-9 and best_person != src:
+                    if src >= 0:
+                        self.place(src, -cents, -1)
+                    if best_person >= 0:
+                        self.place(best_person, cents, 1)
+                    owners[i] = best_person
+                    improved = True
+            if not improved:
+                break
+        self.heap = [(total - target, p)
+                     for p, (total, target) in enumerate(zip(self.totals, self.targets))]
+        heapq.heapify(self.heap)
+        
+        self.unused += sum(1 for p in owners if p < 0)
+        return [(filename, cents / 100, self.names[p] if p >= 0 else None)
+                for (cents, filename), p in zip(items, owners)]
+    
+    def amounts(self):
+        """每人的当前分配金额（元）"""
+        return {name: total / 100 for name, total in zip(self.names, self.totals)}
+
+
 class InvoiceAllocator:
     def __init__(self):
-        self.invoices = []
+        self.invoices = InvoiceList()
         self.people = []
         self.allocations = {}
         self.folder_path = "."  # 默认当前目录
+        self.recursive = False  # 是否扫描子文件夹
         self.lower_bound = 0.97  # 默认下限
         self.upper_bound = 1.03  # 默认上限
+        self.stats = None  # 求解统计（SolverStats），None 表示不统计
+        self.blocked = None  # 可行性预检查得到的每人不可用金额（分）
+        self.unusable = frozenset()  # 任何人都不可用的发票下标
+        self._subset_sums = None  # 最近一次计算的子集和位集
+        self.ledger = None  # 发票台账（InvoiceLedger），None 表示不跳过已分配的发票
+        self.checkpoint_dir = None  # 增强算法检查点的保存目录，None 表示不保存
+        self.interrupted = False  # 最近一次求解是否被 Ctrl-C 中断（结果只是目前的最佳方案）
         
+    def __getstate__(self):
+        # 统计得分计算次数的包装函数无法序列化，在工作进程中重新安装
+        state = self.__dict__.copy()
+        state.pop("calculate_score", None)
+        # 子集和位集可能很大，工作进程不需要
+        state["_subset_sums"] = None
+        # 数据库连接不能跨进程使用
+        state["ledger"] = None
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stats = self._stats
+    
+    @property
+    def stats(self):
+        """求解统计（SolverStats），None 表示不统计"""
+        return self._stats
+    
+    @stats.setter
+    def stats(self, stats):
+        # 启用统计时用计数的包装函数覆盖 calculate_score，关闭时没有任何额外开销
+        self._stats = stats
+        self.__dict__.pop("calculate_score", None)
+        if stats is not None:
+            calculate_score = type(self).calculate_score
+            
+            def counted_score(actual_amount, quota):
+                stats.counters["score_calls"] = stats.counters.get("score_calls", 0) + 1
+                return calculate_score(self, actual_amount, quota)
+            
+            self.calculate_score = counted_score
+    
+    def phase(self, name):
+        """统计一个求解阶段的用时，未启用统计时不做任何事"""
+        if self._stats is None:
+            return contextlib.nullcontext()
+        return self._stats.phase(name)
+    
+    @property
+    def invoices(self):
+        """发票列表，以紧凑数组保存（见 InvoiceList）"""
+        return self._invoices
+    
+    @invoices.setter
+    def invoices(self, invoices):
+        if not isinstance(invoices, InvoiceList):
+            invoices = InvoiceList(invoices)
+        self._invoices = invoices
+    
     def get_user_input(self):
         """获取用户输入的人名、额度和参数"""
         print("=== 发票分配系统 ===")
@@ -96,21 +1089,63 @@ class InvoiceAllocator:
             except ValueError:
                 print("请输入有效数字！")
     
-    def scan_invoices(self, folder_path="."):
-        """扫描文件夹中的发票文件"""
+    def scan_invoices(self, folder_path=".", recursive=False, use_cache=True,
+                      content_check=None, workers=None, deduplicate=True):
+        """扫描文件夹中的发票文件
+
+        recursive: 是否扫描子文件夹（跳过输出目录），发票以相对路径记录
+        use_cache: 是否使用持久缓存，未变化的文件不再重复解析金额
+        content_check: 从 PDF 内容读取金额的方式（需要 pypdf）。None 只使用
+                       文件名；"missing" 只处理文件名中没有金额的发票；
+                       "verify" 核对所有发票，不一致时以发票内容为准
+        workers: 读取 PDF 内容的进程数，None 表示使用全部 CPU
+        deduplicate: 是否排除内容完全相同的重复发票
+        """
         self.folder_path = folder_path
+        self.recursive = recursive
         print("正在扫描发票文件...")
-        self.invoices = []
+        self.invoices = InvoiceList()
         
-        # 支持多种文件扩展名
-        pdf_pattern = re.compile(r'\.pdf$', re.IGNORECASE)
+        if content_check is not None and PdfReader is None:
+            print("警告：未安装 pypdf，无法从发票内容读取金额")
+            content_check = None
         
-        for filename in os.listdir(folder_path):
-            if pdf_pattern.search(filename):
-                # 提取金额
-                amount = self.extract_amount_from_filename(filename)
-                if amount is not None:
-                    self.invoices.append((filename, amount))
+        cache = ScanCache.for_folder(folder_path) if use_cache else None
+        pending = []
+        for filename, amount in self.iter_invoices(folder_path, recursive, cache,
+                                                   include_missing=content_check is not None):
+            if content_check == "verify" or amount is None:
+                pending.append((filename, amount))
+            else:
+                self.invoices.append((filename, amount))
+        if cache is not None:
+            cache.save()
+        
+        if pending:
+            content_amounts = self.read_content_amounts(
+                [filename for filename, _ in pending], workers)
+            for filename, amount in pending:
+                content_amount = content_amounts.get(filename)
+                if content_amount is None:
+                    if amount is not None:
+                        self.invoices.append((filename, amount))
+                    continue
+                if amount is None:
+                    print(f"从发票内容读取金额: {filename} -> {content_amount:.2f}元")
+                elif to_cents(amount) != to_cents(content_amount):
+                    print(f"警告：'{filename}' 文件名金额 {amount:.2f}元 与发票内容金额 "
+                          f"{content_amount:.2f}元 不一致，使用发票内容金额")
+                self.invoices.append((filename, content_amount))
+        
+        if deduplicate:
+            self.collapse_duplicates()
+        
+        if self.ledger is not None:
+            allocated = self.allocated_filenames(self.invoices.names)
+            if allocated:
+                self.invoices = InvoiceList(invoice for invoice in self.invoices
+                                            if invoice[0] not in allocated)
+                print(f"跳过 {len(allocated)} 张已分配过的发票")
         
         print(f"找到 {len(self.invoices)} 张发票")
         
@@ -119,7 +1154,7 @@ class InvoiceAllocator:
             return False
         
         # 显示发票统计信息
-        total_amount = sum(amount for _, amount in self.invoices)
+        total_amount = self.invoices.total()
         print(f"发票总金额: {total_amount:.2f}元")
         
         # 检查总金额是否在合理范围内
@@ -136,15 +1171,107 @@ class InvoiceAllocator:
         
         return True
     
+    def iter_invoices(self, folder_path=".", recursive=False, cache=None, include_missing=False):
+        """逐个产生文件夹中的发票 (相对路径, 金额)
+
+        基于 os.scandir 流式遍历，不会一次性读入整个目录。缓存命中
+        （路径、大小、修改时间均未变化）时直接使用缓存的金额。
+        include_missing 为 True 时，文件名中没有金额的发票也会产生，金额为 None。
+        """
+        for relpath, size, mtime in iter_pdf_files(folder_path, recursive):
+            if cache is not None:
+                hit, amount = cache.get(relpath, size, mtime)
+                if not hit:
+                    amount = self.extract_amount_from_filename(relpath)
+                    cache.put(relpath, size, mtime, amount)
+                elif amount is None:
+                    print(f"警告：无法从文件名 '{relpath}' 中提取金额")
+            else:
+                amount = self.extract_amount_from_filename(relpath)
+            
+            if amount is not None or include_missing:
+                yield relpath, amount
+    
+    def watch_invoices(self, folder_path=".", recursive=False, interval=ONLINE_POLL_INTERVAL):
+        """持续监视文件夹，逐个产生新出现的发票 (相对路径, 金额)，直到被中断
+
+        以已处理文件的最新状态改变时间（ctime）为水位线，只记住 ctime 恰好
+        等于水位线的文件名。mv、cp -p 和解压会保留原来的修改时间，但在 POSIX
+        系统上都会更新 ctime，因此这些文件同样会被发现。写入尚未完成的文件
+        之后 ctime 还会变化，最近产生过的 ONLINE_RECENT_FILES 个文件名不会再次
+        产生。内存占用不随文件数增长。
+        """
+        watermark = -1
+        at_watermark = set()
+        recent = OrderedDict()
+        while True:
+            newest = watermark
+            newest_names = set()
+            for relpath, _, ctime in iter_pdf_files(folder_path, recursive, change_time=True):
+                if ctime < watermark or (ctime == watermark and relpath in at_watermark):
+                    continue
+                if ctime > newest:
+                    newest, newest_names = ctime, {relpath}
+                elif ctime == newest:
+                    newest_names.add(relpath)
+                if relpath in recent:
+                    continue
+                recent[relpath] = None
+                if len(recent) > ONLINE_RECENT_FILES:
+                    recent.popitem(last=False)
+                amount = self.extract_amount_from_filename(relpath)
+                if amount is not None:
+                    yield relpath, amount
+            if newest == watermark:
+                at_watermark |= newest_names
+            else:
+                watermark, at_watermark = newest, newest_names
+            time.sleep(interval)
+    
+    def read_content_amounts(self, filenames, workers=None):
+        """从 PDF 内容读取金额，返回 {文件名: 金额}（读不出的为 None）
+
+        先在进程池中计算文件的 SHA-256 并查询内容缓存，只有缓存未命中的
+        文件才会被解析；解析同样在进程池中并行进行。
+        """
+        print(f"正在从发票内容读取金额（{len(filenames)} 个文件）...")
+        paths = [os.path.join(self.folder_path, filename) for filename in filenames]
+        cache = ContentCache()
+        amounts = {}
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            digests = list(executor.map(_content_digest, paths, chunksize=16))
+            
+            to_parse = {}
+            for filename, path, digest in zip(filenames, paths, digests):
+                if digest is None:
+                    amounts[filename] = None
+                    continue
+                hit, amount = cache.get(digest)
+                if hit:
+                    amounts[filename] = amount
+                else:
+                    to_parse.setdefault(digest, (path, []))[1].append(filename)
+            
+            parsed = executor.map(extract_amount_from_pdf,
+                                  [path for path, _ in to_parse.values()], chunksize=4)
+            for (digest, (_, names)), amount in zip(to_parse.items(), parsed):
+                cache.put(digest, amount)
+                for filename in names:
+                    amounts[filename] = amount
+        
+        cache.save()
+        print(f"解析了 {len(to_parse)} 个文件，其余 {len(filenames) - len(to_parse)} 个来自缓存或内容重复")
+        return amounts
+    
     def extract_amount_from_filename(self, filename: str) -> float:
-        """从文件名中提取金额 - 修复版本"""
-        # 移除文件扩展名
-        name_without_ext = os.path.splitext(filename)[0]
+        """从文件名中提取金额 - 修复版本（filename 可以包含子目录，只解析文件名部分）"""
+        # 移除目录和文件扩展名
+        name_without_ext = os.path.splitext(os.path.basename(filename))[0]
         
         # 改进的正则表达式：匹配人名后的第一个金额，忽略括号内的数字
         # 模式：空格后跟数字（可能包含小数点），然后可能是空格和括号
-        amount_pattern = re.compile(r'\s+(\d+\.?\d*)\s*(?:\(|\.pdf|$)')
-        match = amount_pattern.search(name_without_ext)
+        match = AMOUNT_PATTERN.search(name_without_ext)
         
         if match:
             try:
@@ -155,9 +1282,8 @@ class InvoiceAllocator:
         
         # 备用方案：尝试匹配文件名中的任何金额（排除括号内的）
         # 先移除括号内容，再匹配金额
-        name_without_brackets = re.sub(r'\([^)]*\)', '', name_without_ext)
-        amount_pattern_fallback = re.compile(r'(\d+\.?\d*)')
-        matches = amount_pattern_fallback.findall(name_without_brackets)
+        name_without_brackets = BRACKET_PATTERN.sub('', name_without_ext)
+        matches = AMOUNT_FALLBACK_PATTERN.findall(name_without_brackets)
         
         if matches:
             try:
@@ -189,331 +1315,1764 @@ class InvoiceAllocator:
             # 超过上限，惩罚很大
             return (actual - max_amount) ** 2 * 100
     
-    def find_optimal_allocation(self):
-        """使用增强的最小偏差算法寻找最优分配方案"""
+    def range_score(self, total, quota, low, high):
+        """金额 total（分）的得分项，超出允许范围 [low, high]（分）时再加上边界处的得分
+
+        calculate_score 在上下限处不连续，刚超出范围的得分反而低于边界处；
+        允许中间状态越界的算法（模拟退火、增量调整、在线分配）用它比较得分，
+        越界状态因此总比边界处更差。
+        """
+        value = self.calculate_score(total / 100, quota)
+        if total < low:
+            value += self.calculate_score(low / 100, quota)
+        elif total > high:
+            value += self.calculate_score(high / 100, quota)
+        return value
+    
+    def get_bounds_cents(self, quota):
+        """计算某人额度对应的 (目标, 下限, 上限)，单位为分"""
+        target = to_cents(quota)
+        min_cents = math.ceil(round(quota * self.lower_bound * 100, 6))
+        max_cents = math.floor(round(quota * self.upper_bound * 100, 6))
+        return target, min_cents, max_cents
+
+    def find_optimal_allocation(self, method="auto", workers=None, seed=None,
+                                time_budget=None, target_score=None, use_cache=True):
+        """寻找最优分配方案
+
+        method: "auto" 小规模时使用精确算法，否则使用增强的最小偏差算法；
+                "exact" 强制使用精确算法；其他值为启发式求解策略，可以是
+                SOLVER_STRATEGIES 中的名称（"heuristic" 增强的最小偏差算法，
+                "anneal" 模拟退火，"decompose" 分解后并行求解），或可调用对象
+                strategy(allocator, workers=, seed=, stop_score=, deadline=)，
+                返回 (allocation, amounts)
+        workers, seed: 传递给增强算法的并行进程数和随机种子
+        time_budget: 时间预算（秒），在截止时间前持续改进，到时返回当前最佳方案
+        target_score: 得到不高于该得分的有效方案后立即返回；
+                      达到可证明的得分下界时无论是否指定都会立即返回
+        use_cache: 是否使用方案缓存。相同的发票金额、额度、上下限和求解参数
+                   再次求解时直接返回缓存的方案（method 为可调用对象时不缓存；
+                   求解被中断时结果不写入缓存）
+        """
         print("\n正在计算最优分配方案...")
+        
+        cache = SolutionCache() if use_cache and not callable(method) else None
+        if cache is not None:
+            # 规范顺序：按金额从小到大，金额相同的发票可以互换
+            cents = self.invoices.cents
+            order = sorted(range(len(cents)), key=cents.__getitem__)
+            bounds = [self.get_bounds_cents(quota) for quota in self.allocations.values()]
+            settings = [method, seed, time_budget, target_score]
+            key = cache.fingerprint([cents[idx] for idx in order], bounds,
+                                    self.lower_bound, self.upper_bound, settings)
+            stored = cache.get(key)
+            if stored is not None and len(stored) == len(order):
+                assignment = array('i', [-1]) * len(order)
+                for k, idx in enumerate(order):
+                    assignment[idx] = stored[k]
+                print("使用缓存的分配方案（发票金额、额度和参数均与之前相同）")
+                return self.allocation_from_assignment(assignment)
+        
+        allocation, amounts = self.solve_allocation(method, workers, seed, time_budget,
+                                                    target_score)
+        
+        if cache is not None and allocation is not None and not self.interrupted:
+            assignment = self.assignment_from_allocation(allocation)
+            cache.put(key, [assignment[idx] for idx in order])
+        return allocation, amounts
+    
+    def solve_allocation(self, method="auto", workers=None, seed=None,
+                         time_budget=None, target_score=None):
+        """求解分配方案（不使用缓存），参数见 find_optimal_allocation"""
         print("这可能需要一些时间，请耐心等待...")
+        self.interrupted = False
+
+        deadline = time.time() + time_budget if time_budget is not None else None
+        # 精确算法未完成时退回增强的最小偏差算法
+        strategy = self.get_strategy("heuristic" if method in ("auto", "exact") else method)
+
+        # 可行性预检查：有人的范围无法达到时不必求解
+        with self.phase("feasibility"):
+            blocking = self.check_feasibility()
+        if blocking:
+            print(f"不存在满足要求的分配方案：{len(blocking)} 人的分配范围无法达到")
+            return None, None
+
+        use_exact = method == "exact" or (
+            method == "auto"
+            and len(self.invoices) <= EXACT_MAX_INVOICES
+            and len(self.people) <= EXACT_MAX_PEOPLE
+        )
+
+        if use_exact:
+            with self.phase("exact"):
+                allocation, amounts, proven = self.exact_allocation(
+                    max_nodes=EXACT_MAX_NODES if method == "exact" else EXACT_AUTO_MAX_NODES,
+                    deadline=deadline, stop_score=target_score)
+            if proven or self.interrupted:
+                return allocation, amounts
+            if allocation is not None:
+                if target_score is not None and self.total_score(amounts) <= target_score:
+                    print("已达到目标得分")
+                    return allocation, amounts
+                if deadline is not None and time.time() >= deadline:
+                    print("时间预算已用完，返回当前最佳方案")
+                    return allocation, amounts
+            print("精确算法未能在搜索上限内完成，改用增强算法...")
+            heuristic_allocation, heuristic_amounts = strategy(
+                workers=workers, seed=seed, stop_score=target_score, deadline=deadline)
+            if allocation is None:
+                return heuristic_allocation, heuristic_amounts
+            # 取两者中得分更低的有效方案
+            if (self.is_valid_allocation(heuristic_amounts) and
+                    self.total_score(heuristic_amounts) < self.total_score(amounts)):
+                return heuristic_allocation, heuristic_amounts
+            return allocation, amounts
+
+        # 使用启发式求解策略
+        return strategy(workers=workers, seed=seed, stop_score=target_score, deadline=deadline)
+    
+    def get_strategy(self, method):
+        """返回启发式求解策略对应的可调用对象"""
+        if callable(method):
+            return functools.partial(method, self)
+        if method not in SOLVER_STRATEGIES:
+            raise ValueError(f"未知的求解方法: {method}")
+        return getattr(self, SOLVER_STRATEGIES[method])
+
+    def total_score(self, amounts):
+        """计算所有人的总得分"""
+        return sum(self.calculate_score(amounts[name], quota)
+                   for name, quota in self.allocations.items())
+
+    def is_valid_allocation(self, amounts):
+        """检查每个人的分配金额是否都在允许范围内"""
+        for name, quota in self.allocations.items():
+            if not (quota * self.lower_bound <= amounts[name] <= quota * self.upper_bound):
+                return False
+        return True
+
+    def subset_sums(self, cap):
+        """当前发票不超过 cap 分的子集和位集
+
+        可行性预检查和得分下界使用相同的位集，按发票内容缓存最近一次的结果。
+        """
+        cents = self.invoices.cents
+        key = (cap, len(cents), hash(cents.tobytes()))
+        if self._subset_sums is None or self._subset_sums[0] != key:
+            self._subset_sums = (key, subset_sum_bits(cents, cap))
+        return self._subset_sums[1]
+    
+    def check_feasibility(self):
+        """求解前的可行性预检查
+
+        用全部发票的子集和位集（以分为单位）检查每人的
+        [额度×下限, 额度×上限] 区间能否被某个发票组合落入，并求出每人
+        不可能收到的发票金额（必要条件，只会少排除、不会误排除）。
+        结果保存在 self.blocked（每人不可用的金额集合）和 self.unusable
+        （任何人都不可用的发票下标），供精确算法和贪心分配缩小搜索范围。
+
+        返回无法达到范围的人名列表；规模过大、位集计算代价过高时不做检查。
+        """
+        self.blocked = None
+        self.unusable = frozenset()
+        quotas = list(self.allocations.values())
+        bounds = [self.get_bounds_cents(quota) for quota in quotas]
+        cents = self.invoices.cents
+        cap = max((high for _, _, high in bounds), default=0)
+        if cap * len(cents) > LOWER_BOUND_MAX_BITS:
+            return []
+        
+        reach = self.subset_sums(cap)
+        amounts = sorted(set(cents))
+        blocking = []
+        blocked = []
+        windows = {}
+        for name, (_, low, high) in zip(self.allocations, bounds):
+            if not window_reachable(reach, low, high):
+                blocking.append(name)
+            # 范围相同的人结果相同
+            if (low, high) not in windows:
+                windows[(low, high)] = blocked_amounts(reach, low, high, amounts)
+            blocked.append(windows[(low, high)])
+        
+        if blocking:
+            print("可行性预检查：以下人员的分配范围无法由任何发票组合达到")
+            for name in blocking:
+                _, low, high = self.get_bounds_cents(self.allocations[name])
+                print(f"  {name}: 需要 {low / 100:.2f} - {high / 100:.2f}元")
+            return blocking
+        
+        self.blocked = blocked
+        unusable = set.intersection(*blocked) if blocked else set()
+        if unusable:
+            self.unusable = frozenset(i for i, c in enumerate(cents) if c in unusable)
+            print(f"可行性预检查：{len(self.unusable)} 张发票无法分配给任何人，已排除")
+        return blocking
+    
+    def exact_allocation(self, max_nodes=EXACT_MAX_NODES, deadline=None, stop_score=None):
+        """精确算法：以分为单位的分支定界
+
+        每张发票依次分配给某人或不使用。下界由剩余发票的子集和可达性
+        （大整数位集）逐人计算，因此只要搜索完成，结果即为得分最低的
+        有效方案；若不存在有效方案则返回 (None, None, True)。
+
+        到达截止时间 deadline、找到不高于 stop_score 的方案或被 Ctrl-C
+        中断时提前结束，返回当前最佳方案；被中断时设置 self.interrupted。
+
+        返回 (allocation, amounts, proven)，proven 表示搜索已完成。
+        """
+        print(f"使用精确算法（分支定界），最多搜索 {max_nodes} 个节点...")
+
+        names = list(self.allocations)
+        quotas = [self.allocations[name] for name in names]
+        bounds = [self.get_bounds_cents(q) for q in quotas]
+        targets = [b[0] for b in bounds]
+        lows = [b[1] for b in bounds]
+        highs = [b[2] for b in bounds]
+        num_people = len(names)
+        # 可行性预检查得到的每人不可能收到的金额
+        blocked = self.blocked
+
+        # 发票按金额降序排列，大额发票先分支
+        items = sorted(((c, i) for i, c in enumerate(self.invoices.cents)),
+                       key=lambda x: -x[0])
+        cents = [c for c, _ in items]
+        n = len(items)
+
+        # 剩余发票的子集和可达位集（只保留不超过最大上限的部分）
+        cap = max(highs) if highs else 0
+        mask = (1 << (cap + 1)) - 1
+        suffix_bits = [1] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            bits = suffix_bits[i + 1]
+            suffix_bits[i] = (bits | (bits << cents[i])) & mask
+
+        score_cache = {}
+
+        def score(p, value):
+            key = (p, value)
+            s = score_cache.get(key)
+            if s is None:
+                s = self.calculate_score(value / 100, quotas[p])
+                score_cache[key] = s
+            return s
+
+        bound_cache = {}
+
+        def person_bound(p, current, idx):
+            """该人在剩余发票中能达到的最低得分，不可达时返回 None"""
+            key = (p, current, idx)
+            if key in bound_cache:
+                return bound_cache[key]
+            best = None
+            for total in reachable_totals(suffix_bits[idx], current,
+                                          targets[p], lows[p], highs[p]):
+                value = score(p, total)
+                if best is None or value < best:
+                    best = value
+            if len(bound_cache) < max_nodes:
+                bound_cache[key] = best
+            return best
+
+        amounts = [0] * num_people
+        assignment = [-1] * n
+        best = {"score": float('inf'), "assignment": None}
+        visited = set()
+        nodes = 0
+        aborted = False
+
+        def node_bound(idx):
+            """当前状态下所有人的下界之和，任何人不可达时返回 None"""
+            lower = 0
+            for p in range(num_people):
+                term = person_bound(p, amounts[p], idx)
+                if term is None:
+                    return None
+                lower += term
+            return lower
+
+        def search(idx):
+            nonlocal nodes, aborted
+            nodes += 1
+            if nodes > max_nodes:
+                aborted = True
+                return
+            if deadline is not None and nodes % 256 == 0 and time.time() >= deadline:
+                aborted = True
+                return
+
+            key = (idx, tuple(amounts))
+            if key in visited:
+                return
+            if len(visited) < max_nodes:
+                visited.add(key)
+
+            lower = node_bound(idx)
+            if lower is None or lower >= best["score"] - 1e-9:
+                return
+
+            # 剩余发票全部不使用时，当前状态即是一个完整方案
+            if all(lows[p] <= amounts[p] <= highs[p] for p in range(num_people)):
+                current_score = sum(score(p, amounts[p]) for p in range(num_people))
+                if current_score < best["score"]:
+                    best["score"] = current_score
+                    best["assignment"] = assignment.copy()
+                    if self.stats is not None:
+                        self.stats.best(current_score, "exact")
+                    if stop_score is not None and current_score <= stop_score:
+                        aborted = True
+                        return
+                if current_score <= lower + 1e-9:
+                    return
+
+            if idx == n:
+                return
+
+            amount = cents[idx]
+            # 缺口越大的人越先尝试；额度与当前金额都相同的人只需尝试一次
+            order = sorted(range(num_people), key=lambda p: (amounts[p] - targets[p]) / targets[p])
+            tried = set()
+            for p in order:
+                if aborted:
+                    return
+                if amounts[p] + amount > highs[p]:
+                    continue
+                if blocked is not None and amount in blocked[p]:
+                    continue
+                state = (targets[p], lows[p], highs[p], amounts[p])
+                if state in tried:
+                    continue
+                tried.add(state)
+                amounts[p] += amount
+                assignment[idx] = p
+                search(idx + 1)
+                amounts[p] -= amount
+                assignment[idx] = -1
+
+            # 不使用该发票
+            if not aborted:
+                search(idx + 1)
+
+        try:
+            search(0)
+        except KeyboardInterrupt:
+            if best["assignment"] is None:
+                raise
+            print("\n计算被中断，返回目前找到的最佳方案")
+            self.interrupted = True
+            aborted = True
+        proven = not aborted
+        if self.stats is not None:
+            self.stats.count("exact_nodes", nodes)
+
+        if best["assignment"] is None:
+            if proven:
+                print("精确算法已证明：不存在满足上下限要求的分配方案")
+            return None, None, proven
+
+        assignment = array('i', [-1]) * n
+        for idx, p in enumerate(best["assignment"]):
+            assignment[items[idx][1]] = p
+        allocation, amounts_result = self.allocation_from_assignment(assignment)
+
+        if proven:
+            print(f"精确算法完成（{nodes} 个节点），已证明为最优方案，得分: {best['score']:.4f}")
+        else:
+            print(f"精确算法提前结束，当前最佳得分: {best['score']:.4f}")
+        return allocation, amounts_result, proven
+    
+    def score_lower_bound(self):
+        """总得分的可证明下界
+
+        每人独立地从全部发票中选取最优子集时的得分之和（忽略一张发票只能
+        分给一个人的限制）。某人无论如何都无法进入允许范围时返回 None；
+        规模过大、位集计算代价过高时返回 0。
+        """
+        quotas = list(self.allocations.values())
+        bounds = [self.get_bounds_cents(quota) for quota in quotas]
+        cap = max((high for _, _, high in bounds), default=0)
+        if cap * len(self.invoices) > LOWER_BOUND_MAX_BITS:
+            return 0.0
         
-        # 使用增强的最小偏差算法
-        return self.enhanced_min_deviation_allocation()
+        reach = self.subset_sums(cap)
+        lower = 0.0
+        for quota, (target, low, high) in zip(quotas, bounds):
+            totals = reachable_totals(reach, 0, target, low, high)
+            if not totals:
+                return None
+            lower += min(self.calculate_score(total / 100, quota) for total in totals)
+        return lower
     
-    def enhanced_min_deviation_allocation(self):
-        """增强的最小偏差算法"""
+    def enhanced_min_deviation_allocation(self, workers=None, seed=None, stop_score=None,
+                                          deadline=None):
+        """增强的最小偏差算法
+
+        workers: 并行进程数，None 或 1 为串行，0 表示使用全部 CPU
+        seed: 随机种子，第 i 次迭代使用由 (seed, i) 派生的独立随机数，
+              因此相同种子下并行与串行的结果完全一致
+        stop_score: 某次迭代得到不高于该得分的有效方案后，不再进行后续迭代；
+                    可证明的得分下界总会作为终止条件之一
+        deadline: 截止时间（time.time() 时间戳）。指定后不再限制迭代次数，
+                  持续迭代直到截止时间
+
+        设置了 checkpoint_dir 时定期保存检查点；对相同的问题再次运行时
+        （未指定种子或种子相同）从检查点继续，而不是重新开始。
+        """
         # 多次尝试，选择偏差最小的方案
-        best_allocation = None
-        best_amounts = None
+        best_assignment = None
         best_score = float('inf')
         
         # 根据发票数量和人数调整迭代次数
-        if len(self.invoices) <= 20 and len(self.people) <= 4:
+        if deadline is not None:
+            num_iterations = None
+        elif len(self.invoices) <= 20 and len(self.people) <= 4:
             num_iterations = 100
         elif len(self.invoices) <= 40 and len(self.people) <= 6:
             num_iterations = 50
         else:
             num_iterations = 30
         
-        print(f"使用增强算法，进行 {num_iterations} 次迭代...")
+        # 达到下界的方案不可能再被改进，可以立即返回
+        with self.phase("lower_bound"):
+            lower = self.score_lower_bound()
+        if lower is None:
+            print("警告：已证明不存在满足要求的分配方案，将返回最佳近似方案")
+            lower = 0.0
+        else:
+            print(f"总得分下界: {lower:.4f}")
+        stop_score = lower + 1e-9 if stop_score is None else max(stop_score, lower + 1e-9)
+        
+        checkpoint = None
+        if self.checkpoint_dir is not None:
+            # 各次迭代的结果与发票顺序有关，指纹使用当前顺序而不是规范顺序
+            bounds = [self.get_bounds_cents(quota) for quota in self.allocations.values()]
+            key = SolutionCache.fingerprint(self.invoices.cents, bounds, self.lower_bound,
+                                            self.upper_bound, ["restarts", num_iterations, stop_score])
+            checkpoint_path = os.path.join(self.checkpoint_dir, f"{key}.json")
+            checkpoint = RestartCheckpoint.load(checkpoint_path)
+            if checkpoint is not None and (
+                    (seed is not None and seed != checkpoint.seed)
+                    or (checkpoint.best is None and num_iterations
+                        and checkpoint.done >= num_iterations)):
+                checkpoint = None
+            if checkpoint is not None:
+                seed = checkpoint.seed
+                best = f"，目前最佳得分 {checkpoint.best[0]:.4f}" if checkpoint.best else ""
+                print(f"从检查点继续：已完成 {checkpoint.done} 次迭代{best}")
         
-        for iteration in range(num_iterations):
-            if iteration % 10 == 0:
-                print(f"已完成 {iteration}/{num_iterations} 次迭代...")
-            
-            allocation = {name: [] for name in self.allocations}
-            amounts = {name: 0.0 for name in self.allocations}
-            
-            # 使用不同的初始策略
-            if iteration % 3 == 0:
-                # 策略1: 随机打乱发票
-                shuffled_invoices = self.invoices.copy()
-                random.shuffle(shuffled_invoices)
-            elif iteration % 3 == 1:
-                # 策略2: 按金额降序排列
-                shuffled_invoices = sorted(self.invoices, key=lambda x: x[1], reverse=True)
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        if workers == 0:
+            workers = os.cpu_count() or 1
+        if self.checkpoint_dir is not None and checkpoint is None:
+            checkpoint = RestartCheckpoint(checkpoint_path, seed)
+        start = checkpoint.done if checkpoint is not None else 0
+        resumed = checkpoint.best if checkpoint is not None else None
+        
+        rounds = f"进行 {num_iterations} 次迭代" if num_iterations else "持续迭代至时间预算用完"
+        with self.phase("restarts"):
+            if resumed is not None and (resumed[0] <= stop_score
+                                        or (num_iterations and start >= num_iterations)):
+                results = []
+            elif workers and workers > 1:
+                print(f"使用增强算法，{workers} 个进程并行{rounds}（种子 {seed}）...")
+                results = self.run_restarts_parallel(num_iterations, seed, stop_score, workers,
+                                                     deadline, start, checkpoint)
             else:
-                # 策略3: 按金额升序排列
-                shuffled_invoices = sorted(self.invoices, key=lambda x: x[1])
+                print(f"使用增强算法，{rounds}（种子 {seed}）...")
+                results = self.run_restarts_serial(num_iterations, seed, stop_score, deadline,
+                                                   start, checkpoint)
+        
+        if checkpoint is not None:
+            if checkpoint.interrupted:
+                checkpoint.save()
+                print(f"进度已保存，下次对相同的发票和额度运行时将从第 {checkpoint.done} 次迭代继续")
+            else:
+                checkpoint.remove()
+        if resumed is not None:
+            score, iteration, assignment = resumed
+            results = sorted(results + [(iteration, assignment, None, score, True)],
+                             key=lambda r: r[0])
+        
+        # 按迭代顺序汇总，保证与串行运行的选择一致；
+        # 每次迭代都生成独立的分配向量，记录最佳方案无需复制
+        for iteration, assignment, totals, score, valid in results:
+            if valid and score < best_score:
+                best_score = score
+                best_assignment = assignment
+                print(f"发现更好方案，得分: {best_score:.4f}")
+        
+        if best_assignment is not None:
+            if best_score <= lower + 1e-9:
+                print(f"找到最优方案（已达到得分下界），最终得分: {best_score:.4f}")
+            else:
+                print(f"找到最优方案，最终得分: {best_score:.4f}")
+            return self.allocation_from_assignment(best_assignment)
+        else:
+            # 如果没有完全有效的方案，返回最后一次尝试的结果
+            print("未找到完全符合要求的方案，返回最佳近似方案")
+            return self.allocation_from_assignment(assignment)
+    
+    def annealing_allocation(self, workers=None, seed=None, stop_score=None, deadline=None):
+        """模拟退火算法
+
+        从贪心分配 + 局部优化的结果出发，随机尝试单张移动以及 1 换 1、
+        2 换 1、2 换 2 的复合交换（未使用的发票视为一个额外的持有者），
+        交换对象用二分查找选取，使转移金额接近两人缺口的理想值。允许暂时
+        超出上下限，越界者的得分项由 range_score 计算。按 Metropolis 准则接受变差的操作，
+        温度按几何方式下降，最后对最佳方案再做一次局部优化。
+
+        参数与 enhanced_min_deviation_allocation 相同；只运行一条退火链，
+        workers 未使用。未指定 deadline 时步数由 ANNEAL_STEPS_PER_INVOICE 决定。
+        """
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        rng = random.Random(f"{seed}-anneal")
+        start = time.time()
+        
+        with self.phase("lower_bound"):
+            lower = self.score_lower_bound()
+        if lower is None:
+            print("警告：已证明不存在满足要求的分配方案，将返回最佳近似方案")
+            lower = 0.0
+        else:
+            print(f"总得分下界: {lower:.4f}")
+        stop_score = lower + 1e-9 if stop_score is None else max(stop_score, lower + 1e-9)
+        print(f"使用模拟退火算法（种子 {seed}）...")
+        
+        cents = self.invoices.cents
+        n = len(cents)
+        quotas = list(self.allocations.values())
+        num_people = len(quotas)
+        bounds = [self.get_bounds_cents(quota) for quota in quotas]
+        targets = [target for target, _, _ in bounds]
+        lows = [low for _, low, _ in bounds]
+        highs = [high for _, _, high in bounds]
+        
+        # 初始方案：按金额降序贪心分配后局部优化
+        order = sorted(range(n), key=cents.__getitem__, reverse=True)
+        with self.phase("greedy"):
+            assignment, totals = self.greedy_initial_allocation(order)
+        with self.phase("local_search"):
+            self.local_search(assignment, totals, deadline=deadline)
+        if num_people == 0 or n == 0:
+            return self.allocation_from_assignment(assignment)
+        
+        # 持有者 num_people 表示未使用的发票，其得分项恒为 0
+        pool = num_people
+        
+        def energy(p, total):
+            if p == pool:
+                return 0.0
+            return self.range_score(total, quotas[p], lows[p], highs[p])
+        
+        def out_of_range(p, total):
+            return p != pool and not lows[p] <= total <= highs[p]
+        
+        items = [[] for _ in range(num_people + 1)]
+        for idx, p in enumerate(assignment):
+            items[p if p >= 0 else pool].append((cents[idx], idx))
+        for owner_items in items:
+            owner_items.sort()
+        keys = [[amount for amount, _ in owner_items] for owner_items in items]
+        owner_totals = totals + [sum(keys[pool])]
+        terms = [energy(p, owner_totals[p]) for p in range(num_people + 1)]
+        current = sum(terms)
+        bad = sum(out_of_range(p, owner_totals[p]) for p in range(num_people))
+        best_key = (bad, current)
+        best_assignment = assignment[:]
+        
+        # (q 交出的张数, p 交出的张数) 及其权重
+        shapes = [(1, 0), (0, 1), (1, 1), (2, 1), (1, 2), (2, 2)]
+        shape_weights = list(itertools.accumulate([2, 2, 3, 1.5, 1.5, 1]))
+        
+        def nearest(values, x, taken):
+            """有序列表中最接近 x 且不在 taken 中的位置，没有时返回 None"""
+            idx = bisect.bisect_left(values, x)
+            below, above = idx - 1, idx
+            while below in taken:
+                below -= 1
+            while above in taken:
+                above += 1
+            if below < 0 and above >= len(values):
+                return None
+            if below < 0:
+                return above
+            if above >= len(values):
+                return below
+            return below if x - values[below] <= values[above] - x else above
+        
+        def propose(spread):
+            """随机生成一个复合交换 (p, q, p 交出的位置, q 交出的位置, 转移金额)"""
+            q = rng.randrange(num_people)
+            p = rng.randrange(num_people)
+            if p == q:
+                p = pool
+            # q 的理想净收入：与 p 平分缺口（p 为未使用发票时补足 q 的缺口）
+            gap = targets[q] - owner_totals[q]
+            if p != pool:
+                gap = (gap - (targets[p] - owner_totals[p])) / 2
+            want = gap + rng.uniform(-spread, spread)
             
-            # 第一阶段：初始分配
-            for filename, amount in shuffled_invoices:
-                best_person = None
-                best_score_local = float('inf')
-                
-                for name, quota in self.allocations.items():
-                    min_amount = quota * self.lower_bound
-                    max_amount = quota * self.upper_bound
-                    
-                    if amounts[name] + amount <= max_amount:
-                        # 计算分配后的总得分
-                        temp_amounts = amounts.copy()
-                        temp_amounts[name] += amount
-                        
-                        score = 0
-                        for n, q in self.allocations.items():
-                            score += self.calculate_score(temp_amounts[n], q)
-                        
-                        if score < best_score_local:
-                            best_score_local = score
-                            best_person = name
-            
-                if best_person is not None:
-                    allocation[best_person].append((filename, amount))
-                    amounts[best_person] += amount
-            
-            # 第二阶段：局部优化
-            improved = True
-            local_improvements = 0
-            max_local_iterations = min(100, len(self.invoices) * 2)
-            
-            while improved and local_improvements < max_local_iterations:
-                improved = False
-                local_improvements += 1
-                
-                # 尝试交换发票来优化
-                for name1 in self.allocations:
-                    for name2 in self.allocations:
-                        if name1 == name2:
-                            continue
-                        
-                        # 尝试交换两张发票
-                        for i, (filename1, amount1) in enumerate(allocation[name1]):
-                            for j, (filename2, amount2) in enumerate(allocation[name2]):
-                                # 计算交换后的金额
-                                new_amount1 = amounts[name1] - amount1 + amount2
-                                new_amount2 = amounts[name2] - amount2 + amount1
-                                
-                                quota1 = self.allocations[name1]
-                                quota2 = self.allocations[name2]
-                                min_amount1 = quota1 * self.lower_bound
-                                max_amount1 = quota1 * self.upper_bound
-                                min_amount2 = quota2 * self.lower_bound
-                                max_amount2 = quota2 * self.upper_bound
-                                
-                                # 检查是否满足约束
-                                if (min_amount1 <= new_amount1 <= max_amount1 and 
-                                    min_amount2 <= new_amount2 <= max_amount2):
-                                    
-                                    # 计算交换前后的得分
-                                    old_score = (self.calculate_score(amounts[name1], quota1) + 
-                                               self.calculate_score(amounts[name2], quota2))
-                                    new_score = (self.calculate_score(new_amount1, quota1) + 
-                                               self.calculate_score(new_amount2, quota2))
-                                    
-                                    if new_score < old_score:
-                                        # 执行交换
-                                        allocation[name1][i], allocation[name2][j] = (
-                                            allocation[name2][j], allocation[name1][i])
-                                        amounts[name1] = new_amount1
-                                        amounts[name2] = new_amount2
-                                        improved = True
-                                        break
-                            
-                            if improved:
-                                break
-                        if improved:
+            give_q, give_p = shapes[bisect.bisect(shape_weights, rng.random() * shape_weights[-1])]
+            if len(keys[q]) < give_q or len(keys[p]) < give_p:
+                return None
+            taken_q = set()
+            while len(taken_q) < give_q:
+                taken_q.add(rng.randrange(len(keys[q])))
+            sum_q = sum(keys[q][i] for i in taken_q)
+            taken_p = set()
+            if give_p:
+                while len(taken_p) < give_p - 1:
+                    taken_p.add(rng.randrange(len(keys[p])))
+                partial = sum(keys[p][i] for i in taken_p)
+                i = nearest(keys[p], want + sum_q - partial, taken_p)
+                if i is None:
+                    return None
+                taken_p.add(i)
+            else:
+                # q 只交出一张：重新选取最接近理想金额的一张
+                taken_q = set()
+                i = nearest(keys[q], -want, taken_q)
+                if i is None:
+                    return None
+                taken_q.add(i)
+                sum_q = keys[q][i]
+            shift = sum(keys[p][i] for i in taken_p) - sum_q
+            return p, q, taken_p, taken_q, shift
+        
+        def apply(p, q, taken_p, taken_q):
+            moved_p = [items[p][i] for i in taken_p]
+            moved_q = [items[q][i] for i in taken_q]
+            for owner, taken in ((p, taken_p), (q, taken_q)):
+                for i in sorted(taken, reverse=True):
+                    item = items[owner].pop(i)
+                    keys[owner].pop(i)
+                    owner_totals[owner] -= item[0]
+            for owner, moved in ((q, moved_p), (p, moved_q)):
+                for item in moved:
+                    i = bisect.bisect_left(items[owner], item)
+                    items[owner].insert(i, item)
+                    keys[owner].insert(i, item[0])
+                    owner_totals[owner] += item[0]
+                    assignment[item[1]] = owner if owner != pool else -1
+        
+        temperature = spread = None
+        
+        total_steps = None if deadline is not None else ANNEAL_STEPS_PER_INVOICE * n
+        anneal_start = time.time()
+        step = accepted = 0
+        try:
+            while True:
+                if step % 256 == 0:
+                    if deadline is not None:
+                        now = time.time()
+                        if now >= deadline:
                             break
-                    if improved:
-                        break
+                        fraction = (now - anneal_start) / max(deadline - anneal_start, 1e-9)
+                    else:
+                        if step >= total_steps:
+                            break
+                        fraction = step / total_steps
+                    # 温度与当前每人的平均得分项成正比，并随时间几何下降；
+                    # 转移金额的随机扰动约为每人的平均偏差（分）
+                    scale = max(current, 1e-9) / num_people
+                    temperature = scale * ANNEAL_START_FACTOR * ANNEAL_END_RATIO ** fraction
+                    spread = math.sqrt(scale) * 100
+                step += 1
+                
+                move = propose(spread)
+                if move is None:
+                    continue
+                p, q, taken_p, taken_q, shift = move
+                new_p = owner_totals[p] - shift
+                new_q = owner_totals[q] + shift
+                term_p = energy(p, new_p)
+                term_q = energy(q, new_q)
+                delta = term_p + term_q - terms[p] - terms[q]
+                if delta > 0 and rng.random() >= math.exp(-delta / temperature):
+                    continue
                 
-                # 如果没有交换改进，尝试移动发票
-                if not improved:
-                    for name1 in self.allocations:
-                        for name2 in self.allocations:
-                            if name1 == name2:
-                                continue
-                            
-                            # 尝试将发票从name1移动到name2
-                            for i, (filename, amount) in enumerate(allocation[name1]):
-                                # 计算移动后的金额
-                                new_amount1 = amounts[name1] - amount
-                                new_amount2 = amounts[name2] + amount
-                                
-                                quota1 = self.allocations[name1]
-                                quota2 = self.allocations[name2]
-                                min_amount1 = quota1 * self.lower_bound
-                                max_amount1 = quota1 * self.upper_bound
-                                min_amount2 = quota2 * self.lower_bound
-                                max_amount2 = quota2 * self.upper_bound
-                                
-                                # 检查是否满足约束
-                                if (min_amount1 <= new_amount1 <= max_amount1 and 
-                                    min_amount2 <= new_amount2 <= max_amount2):
-                                    
-                                    # 计算移动前后的得分
-                                    old_score = (self.calculate_score(amounts[name1], quota1) + 
-                                               self.calculate_score(amounts[name2], quota2))
-                                    new_score = (self.calculate_score(new_amount1, quota1) + 
-                                               self.calculate_score(new_amount2, quota2))
-                                    
-                                    if new_score < old_score:
-                                        # 执行移动
-                                        allocation[name2].append(allocation[name1].pop(i))
-                                        amounts[name1] = new_amount1
-                                        amounts[name2] = new_amount2
-                                        improved = True
-                                        break
-                            
-                            if improved:
+                accepted += 1
+                bad += (out_of_range(p, new_p) - out_of_range(p, owner_totals[p])
+                        + out_of_range(q, new_q) - out_of_range(q, owner_totals[q]))
+                apply(p, q, taken_p, taken_q)
+                terms[p] = term_p
+                terms[q] = term_q
+                current += delta
+                if (bad, current) < best_key:
+                    # 累计误差可能使 current 偏离，记录最佳方案时重新求和
+                    current = sum(terms)
+                    if (bad, current) < best_key:
+                        best_key = (bad, current)
+                        best_assignment = assignment[:]
+                        if bad == 0:
+                            if self.stats is not None:
+                                self.stats.best(current, "anneal")
+                            if current <= stop_score:
                                 break
-                        if improved:
-                            break
-            
-            # 计算当前方案的得分
-            score = 0
-            valid = True
-            for name, quota in self.allocations.items():
-                min_amount = quota * self.lower_bound
-                max_amount = quota * self.upper_bound
+        except KeyboardInterrupt:
+            self.interrupted = True
+            print("\n计算被中断，返回目前找到的最佳方案")
+        
+        if self.stats is not None:
+            self.stats.count("anneal_steps", step)
+            self.stats.count("anneal_accepted", accepted)
+        
+        # 对最佳方案再做一次局部优化
+        assignment = best_assignment
+        totals = [0] * num_people
+        for idx, p in enumerate(assignment):
+            if p >= 0:
+                totals[p] += cents[idx]
+        with self.phase("local_search"):
+            self.local_search(assignment, totals, deadline=deadline)
+        
+        allocation, amounts = self.allocation_from_assignment(assignment)
+        status = "" if self.is_valid_allocation(amounts) else "（未找到完全符合要求的方案）"
+        print(f"模拟退火完成：{step} 步，接受 {accepted} 次，用时 {time.time() - start:.1f} 秒，"
+              f"最终得分: {self.total_score(amounts):.4f}{status}")
+        return allocation, amounts
+    
+    def decomposition_allocation(self, workers=None, seed=None, stop_score=None, deadline=None):
+        """分解算法：人数很多时把问题拆成若干子问题并行求解，再跨子问题修复
+
+        人员按额度分成 DECOMPOSE_GROUP_PEOPLE 人左右的组，发票按金额从大到小
+        分给（已分金额 / 组额度）最小的组，使各组的发票总额与额度成比例。
+        每个子问题在进程池中用增强算法独立求解，合并后把各组剩余的发票贪心
+        分给仍有缺口的人，再对偏离目标较多（超出允许范围一半）的人做跨组的
+        局部优化。子问题的规模固定，总用时随问题规模近似线性增长。
+
+        参数与 enhanced_min_deviation_allocation 相同；workers 为 None 或 0 时
+        使用全部 CPU，为 1 时在当前进程中依次求解。stop_score 只用于人数
+        较少、不需要分解的情况。
+        """
+        start = time.time()
+        num_people = len(self.allocations)
+        num_parts = num_people // DECOMPOSE_GROUP_PEOPLE
+        if num_parts < 2:
+            print("人数较少，不需要分解，使用增强算法")
+            return self.enhanced_min_deviation_allocation(workers, seed, stop_score, deadline)
+        
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        if not workers:
+            workers = os.cpu_count() or 1
+        names = list(self.allocations)
+        quotas = list(self.allocations.values())
+        cents = self.invoices.cents
+        
+        with self.phase("partition"):
+            parts = self.partition_problem(num_parts)
+        print(f"使用分解算法：{num_people} 人分为 {num_parts} 个子问题，"
+              f"{workers} 个进程并行求解（种子 {seed}）...")
+        
+        # 时间预算的大部分留给子问题，其余用于修复
+        sub_deadline = None
+        if deadline is not None:
+            sub_deadline = start + (deadline - start) * DECOMPOSE_SOLVE_SHARE
+        subproblems = []
+        for k, (people, indices) in enumerate(parts):
+            sub = InvoiceAllocator()
+            sub.allocations = {names[p]: quotas[p] for p in people}
+            sub.people = list(sub.allocations)
+            sub.lower_bound = self.lower_bound
+            sub.upper_bound = self.upper_bound
+            # 子问题的文件名记录原发票下标，便于合并
+            sub.invoices = InvoiceList((str(idx), cents[idx] / 100) for idx in indices)
+            sub_seed = random.Random(f"{seed}-part{k}").randrange(2 ** 32)
+            subproblems.append((sub, sub_seed, sub_deadline))
+        
+        with self.phase("subproblems"):
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=min(workers, num_parts)) as executor:
+                    results = list(executor.map(_solve_subproblem, *zip(*subproblems)))
+            else:
+                results = [_solve_subproblem(*task) for task in subproblems]
+        solved = time.time()
+        
+        # 合并各子问题的方案
+        assignment = array('i', [-1]) * len(cents)
+        totals = [0] * num_people
+        for (people, _), placed in zip(parts, results):
+            for idx, p in placed:
+                assignment[idx] = people[p]
+                totals[people[p]] += cents[idx]
+        
+        with self.phase("repair"):
+            focus = set()
+            for p, quota in enumerate(quotas):
+                target, low, high = self.get_bounds_cents(quota)
+                if not target - (target - low) / 2 <= totals[p] <= target + (high - target) / 2:
+                    focus.add(p)
+            before = list(totals)
+            order = sorted((idx for idx, p in enumerate(assignment)
+                            if p < 0 and idx not in self.unusable),
+                           key=cents.__getitem__, reverse=True)
+            self.greedy_initial_allocation(order, assignment, totals)
+            focus.update(p for p in range(num_people) if totals[p] != before[p])
+            if focus:
+                self.local_search(assignment, totals, deadline=deadline, focus=focus)
+        
+        allocation, amounts = self.allocation_from_assignment(assignment)
+        score = self.total_score(amounts)
+        if self.stats is not None:
+            self.stats.best(score, "decompose")
+        status = "" if self.is_valid_allocation(amounts) else "（未找到完全符合要求的方案）"
+        print(f"分解算法完成：子问题用时 {solved - start:.1f} 秒，跨组修复 {len(focus)} 人"
+              f"用时 {time.time() - solved:.1f} 秒，最终得分: {score:.4f}{status}")
+        return allocation, amounts
+    
+    def partition_problem(self, num_parts):
+        """把人员和发票分成 num_parts 个子问题，返回 [(人员下标列表, 发票下标列表)]
+
+        人员按额度从大到小分给额度之和最小的组；发票按金额从大到小分给
+        (已分金额 / 组额度) 最小的组。可行性预检查排除的发票不参与分配。
+        """
+        quotas = list(self.allocations.values())
+        cents = self.invoices.cents
+        
+        groups = [[] for _ in range(num_parts)]
+        heap = [(0.0, k) for k in range(num_parts)]
+        for p in sorted(range(len(quotas)), key=quotas.__getitem__, reverse=True):
+            total, k = heapq.heappop(heap)
+            groups[k].append(p)
+            heapq.heappush(heap, (total + quotas[p], k))
+        
+        group_cents = [sum(to_cents(quotas[p]) for p in group) for group in groups]
+        invoices = [[] for _ in range(num_parts)]
+        heap = [(0.0, k) for k in range(num_parts)]
+        for idx in sorted(range(len(cents)), key=cents.__getitem__, reverse=True):
+            if idx in self.unusable:
+                continue
+            ratio, k = heapq.heappop(heap)
+            invoices[k].append(idx)
+            heapq.heappush(heap, (ratio + cents[idx] / group_cents[k], k))
+        return list(zip(groups, invoices))
+    
+    def run_restarts_serial(self, num_iterations, seed, stop_score, deadline=None, start=0,
+                            checkpoint=None):
+        """串行执行各次迭代，返回 [(iteration, assignment, totals, score, valid)]
+
+        只保留依次改进最佳得分的结果和最后一次迭代的结果，汇总结果与保留
+        全部迭代相同。num_iterations 为 None 时持续迭代直到 deadline；
+        被 Ctrl-C 中断时返回已完成迭代的结果。从第 start 次迭代开始，
+        每次迭代的结果记入 checkpoint（RestartCheckpoint，可为 None）。
+        """
+        results = []
+        last = None
+        best_score = float('inf')
+        iterations = range(start, num_iterations) if num_iterations else itertools.count(start)
+        try:
+            for iteration in iterations:
+                if deadline is not None and last is not None and time.time() >= deadline:
+                    print("时间预算已用完")
+                    break
+                if iteration % 10 == 0:
+                    if num_iterations:
+                        print(f"已完成 {iteration}/{num_iterations} 次迭代...")
+                    else:
+                        print(f"已完成 {iteration} 次迭代...")
                 
-                if amounts[name] < min_amount or amounts[name] > max_amount:
-                    valid = False
+                assignment, totals, score, valid = self.run_restart(iteration, seed, deadline=deadline)
+                last = (iteration, assignment, totals, score, valid)
+                if checkpoint is not None:
+                    checkpoint.update(iteration, assignment, score, valid)
+                if valid and score < best_score:
+                    best_score = score
+                    results.append(last)
+                    if self.stats is not None:
+                        self.stats.best(score, "restart", iteration)
+                if self.stats is not None:
+                    self.stats.emit("progress", done=iteration + 1, total=num_iterations)
+                if valid and score <= stop_score:
+                    break
+        except KeyboardInterrupt:
+            self.interrupted = True
+            if checkpoint is not None:
+                checkpoint.interrupted = True
+            if last is None:
+                if checkpoint is not None and checkpoint.best is not None:
+                    return []
+                raise
+            print("\n计算被中断，返回目前找到的最佳方案")
+        if last is not None and (not results or results[-1] is not last):
+            results.append(last)
+        return results
+    
+    def run_restarts_parallel(self, num_iterations, seed, stop_score, workers, deadline=None,
+                              start=0, checkpoint=None):
+        """使用进程池并行执行各次迭代
+
+        共享变量 cutoff 记录最早达到 stop_score 的迭代编号，
+        编号更大的迭代会被跳过或提前终止，其结果也不会被采用。
+        任务按需提交，num_iterations 为 None 时持续提交直到 deadline。
+        start 和 checkpoint 的含义同 run_restarts_serial。
+        """
+        limit = num_iterations or 2 ** 31 - 1
+        cutoff = multiprocessing.Value('i', limit)
+        results = []
+        pending = set()
+        next_iteration = start
+        finished = start
+        best_score = float('inf')
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=_init_restart_worker,
+                                       initargs=(self, cutoff))
+        try:
+            while True:
+                while (len(pending) < workers * 2 and next_iteration < limit
+                       and next_iteration <= cutoff.value
+                       and (deadline is None or next_iteration == start
+                            or time.time() < deadline)):
+                    pending.add(executor.submit(_restart_worker, next_iteration, seed,
+                                                stop_score, deadline))
+                    next_iteration += 1
+                if not pending:
                     break
                 
-                score += self.calculate_score(amounts[name], quota)
-            
-            if valid and score < best_score:
-                best_score = score
-                best_allocation = allocation.copy()
-                best_amounts = amounts.copy()
-                print(f"发现更好方案，得分: {best_score:.4f}")
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result is not None:
+                        *result, stats = result
+                        results.append(tuple(result))
+                        if checkpoint is not None:
+                            iteration, assignment, _, score, valid = result
+                            checkpoint.update(iteration, assignment, score, valid)
+                        if stats is not None:
+                            self.stats.merge(stats)
+                            _, _, _, score, valid = result
+                            if valid and score < best_score:
+                                best_score = score
+                                self.stats.best(score, "restart", result[0])
+                    finished += 1
+                    if self.stats is not None:
+                        self.stats.emit("progress", done=finished, total=num_iterations)
+                    if finished % 10 == 0:
+                        if num_iterations:
+                            print(f"已完成 {finished}/{num_iterations} 次迭代...")
+                        else:
+                            print(f"已完成 {finished} 次迭代...")
+        except KeyboardInterrupt:
+            self.interrupted = True
+            if checkpoint is not None:
+                checkpoint.interrupted = True
+            if not results:
+                if checkpoint is not None and checkpoint.best is not None:
+                    return []
+                raise
+            print("\n计算被中断，返回目前找到的最佳方案")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
         
-        if best_allocation:
-            print(f"找到最优方案，最终得分: {best_score:.4f}")
-            return best_allocation, best_amounts
+        last = cutoff.value
+        return sorted((r for r in results if r[0] <= last), key=lambda r: r[0])
+    
+    def run_restart(self, iteration, seed, cutoff=None, deadline=None):
+        """执行一次贪心分配 + 局部优化，返回 (assignment, totals, score, valid)
+
+        assignment 为分配向量，totals 为每人的分配金额（分）。
+        cutoff 为并行运行时的共享变量，更早的迭代已达到终止条件时返回 None。
+        到达 deadline 时局部优化提前结束。
+        """
+        rng = random.Random(f"{seed}-{iteration}")
+        cents = self.invoices.cents
+        
+        # 使用不同的初始策略
+        if iteration % 3 == 0:
+            # 策略1: 随机打乱发票
+            order = list(range(len(cents)))
+            rng.shuffle(order)
+        elif iteration % 3 == 1:
+            # 策略2: 按金额降序排列
+            order = sorted(range(len(cents)), key=cents.__getitem__, reverse=True)
         else:
-            # 如果没有完全有效的方案，返回最后一次尝试的结果
-            print("未找到完全符合要求的方案，返回最佳近似方案")
-            return allocation, amounts
+            # 策略3: 按金额升序排列
+            order = sorted(range(len(cents)), key=cents.__getitem__)
+        # 可行性预检查已排除的发票不参与分配
+        if self.unusable:
+            order = [idx for idx in order if idx not in self.unusable]
+        
+        if self.stats is not None:
+            self.stats.count("restarts")
+        
+        # 第一阶段：初始分配
+        with self.phase("greedy"):
+            assignment, totals = self.greedy_initial_allocation(order)
+        
+        # 第二阶段：局部优化
+        with self.phase("local_search"):
+            if self.local_search(assignment, totals, cutoff, iteration, deadline) is None:
+                return None
+        
+        # 计算当前方案的得分
+        score = 0
+        valid = True
+        for p, quota in enumerate(self.allocations.values()):
+            _, min_cents, max_cents = self.get_bounds_cents(quota)
+            
+            if totals[p] < min_cents or totals[p] > max_cents:
+                valid = False
+                break
+            
+            score += self.calculate_score(totals[p] / 100, quota)
+        
+        return assignment, totals, score, valid
     
-    def display_solution(self, allocation, amounts):
-        """显示解决方案"""
-        print("\n" + "="*60)
-        print("最优分配方案")
-        print("="*60)
+    def local_search(self, assignment, totals, cutoff=None, iteration=None, deadline=None,
+                     focus=None):
+        """局部优化：最优改进的交换/移动搜索，原地修改 assignment 和 totals
+
+        每人的发票按金额排序。对任意两人，先求出使两人得分之和最低的理想
+        转移金额，再用二分查找在对方的有序列表中定位最接近的交换对象或
+        移动发票，因此每对人的最佳操作只需 O(n log n)。各对人的最佳操作
+        放入堆中，每次执行收益最大的一个，只重新计算涉及变化者的人对，
+        直到没有可改进的操作（局部最优）。与原算法相同，只接受执行后
+        两人都在允许范围内且得分下降的操作。
+
+        cutoff 为并行运行时的共享变量，更早的迭代已达到终止条件时返回 None；
+        到达 deadline 时停止优化，保留当前状态。focus 为人员下标集合，
+        指定时只从涉及这些人的人对开始搜索（其余人对已处于局部最优）。
+        """
+        quotas = list(self.allocations.values())
+        bounds = [self.get_bounds_cents(quota) for quota in quotas]
+        targets = [target for target, _, _ in bounds]
+        lows = [low for _, low, _ in bounds]
+        highs = [high for _, _, high in bounds]
+        num_people = len(quotas)
+        cents = self.invoices.cents
+        
+        # 每人按 (金额, 发票下标) 排序的发票，以及用于二分查找的金额列表
+        items = [[] for _ in range(num_people)]
+        for idx, p in enumerate(assignment):
+            if p >= 0:
+                items[p].append((cents[idx], idx))
+        for person_items in items:
+            person_items.sort()
+        keys = [[amount for amount, _ in person_items] for person_items in items]
+        terms = [self.calculate_score(totals[p] / 100, quotas[p]) for p in range(num_people)]
+        versions = [0] * num_people
+        
+        def slope(p, x):
+            """允许范围内得分函数的导数（相差常数倍，不影响零点）"""
+            deviation = x - targets[p]
+            return 2 * deviation if deviation <= 0 else deviation
+        
+        def ideal_shift(p, q):
+            """p 增加 d、q 减少 d 时两人都在范围内的区间 [L, R] 及最优 d"""
+            low = max(lows[p] - totals[p], totals[q] - highs[q])
+            high = min(highs[p] - totals[p], totals[q] - lows[q])
+            if low > high:
+                return None
+            
+            def derivative(d):
+                return slope(p, totals[p] + d) - slope(q, totals[q] - d)
+            
+            if derivative(low) >= 0:
+                return low, high, low
+            if derivative(high) <= 0:
+                return low, high, high
+            # 导数分段线性且单调递增，在断点之间线性插值求零点
+            points = [low, high]
+            for x in (targets[p] - totals[p], totals[q] - targets[q]):
+                if low < x < high:
+                    points.append(x)
+            points.sort()
+            for x0, x1 in zip(points, points[1:]):
+                g0, g1 = derivative(x0), derivative(x1)
+                if g0 <= 0 <= g1:
+                    if g1 == g0:
+                        return low, high, x0
+                    return low, high, x0 - g0 * (x1 - x0) / (g1 - g0)
+            return low, high, high
+        
+        def neighbours(values, x):
+            """有序列表中与 x 最接近的两个位置"""
+            idx = bisect.bisect_left(values, x)
+            if idx > 0:
+                yield idx - 1
+            if idx < len(values):
+                yield idx
+        
+        def evaluate_pair(p, q):
+            """返回 p、q 之间收益最大的操作 (gain, move)，没有改进时返回 None"""
+            shift = ideal_shift(p, q)
+            if shift is None:
+                return None
+            _, _, best_d = shift
+            base = terms[p] + terms[q]
+            best = [1e-9, None]
+            
+            def consider(d, move):
+                new_p = totals[p] + d
+                new_q = totals[q] - d
+                if lows[p] <= new_p <= highs[p] and lows[q] <= new_q <= highs[q]:
+                    gain = base - (self.calculate_score(new_p / 100, quotas[p]) +
+                                   self.calculate_score(new_q / 100, quotas[q]))
+                    if gain > best[0]:
+                        best[0] = gain
+                        best[1] = move
+            
+            # 移动：p 的发票给 q（d = -a），或 q 的发票给 p（d = b）
+            for i in neighbours(keys[p], -best_d):
+                consider(-keys[p][i], ("move", p, i, q))
+            for j in neighbours(keys[q], best_d):
+                consider(keys[q][j], ("move", q, j, p))
+            
+            # 交换：p 的发票 a 与 q 的发票 b 互换（d = b - a），遍历较短的一方
+            if len(keys[p]) <= len(keys[q]):
+                for i, a in enumerate(keys[p]):
+                    for j in neighbours(keys[q], a + best_d):
+                        consider(keys[q][j] - a, ("swap", p, i, q, j))
+            else:
+                for j, b in enumerate(keys[q]):
+                    for i in neighbours(keys[p], b - best_d):
+                        consider(b - keys[p][i], ("swap", p, i, q, j))
+            
+            if best[1] is None:
+                return None
+            return best[0], best[1]
+        
+        def insert(person, item):
+            idx = bisect.bisect_left(items[person], item)
+            items[person].insert(idx, item)
+            keys[person].insert(idx, item[0])
+            assignment[item[1]] = person
+            totals[person] += item[0]
+        
+        def remove(person, idx):
+            keys[person].pop(idx)
+            item = items[person].pop(idx)
+            totals[person] -= item[0]
+            return item
+        
+        heap = []
+        counter = itertools.count()
+        
+        def push(p, q):
+            if p > q:
+                p, q = q, p
+            result = evaluate_pair(p, q)
+            if result is not None:
+                gain, move = result
+                heapq.heappush(heap, (-gain, next(counter), p, q, versions[p], versions[q], move))
+        
+        pairs = 0
+        for p in range(num_people):
+            # 初始评估所有人对本身也较慢，到达 deadline 时同样停止
+            if deadline is not None and time.time() >= deadline:
+                break
+            for q in range(p + 1, num_people):
+                if focus is None or p in focus or q in focus:
+                    push(p, q)
+                    pairs += 1
+        
+        # 统计用：执行的移动、交换次数和丢弃的过期堆项数
+        moves = swaps = stale = 0
+        
+        def record():
+            if self.stats is not None:
+                applied = moves + swaps
+                self.stats.count("pairs_evaluated", pairs + applied * (2 * num_people - 3))
+                self.stats.count("moves_applied", moves)
+                self.stats.count("swaps_applied", swaps)
+                self.stats.count("stale_entries", stale)
+        
+        while heap:
+            # 已有更早的迭代达到提前终止条件，本次结果不会被采用
+            if cutoff is not None and cutoff.value < iteration:
+                record()
+                return None
+            if deadline is not None and time.time() >= deadline:
+                break
+            
+            _, _, p, q, version_p, version_q, move = heapq.heappop(heap)
+            if versions[p] != version_p or versions[q] != version_q:
+                stale += 1
+                continue
+            
+            if move[0] == "move":
+                moves += 1
+                _, src, idx, dst = move
+                insert(dst, remove(src, idx))
+            else:
+                swaps += 1
+                _, p, i, q, j = move
+                item_p = remove(p, i)
+                item_q = remove(q, j)
+                insert(p, item_q)
+                insert(q, item_p)
+            
+            for person in (p, q):
+                terms[person] = self.calculate_score(totals[person] / 100, quotas[person])
+                versions[person] += 1
+            for other in range(num_people):
+                if other != p and other != q:
+                    push(p, other)
+                    push(q, other)
+            push(p, q)
+        
+        record()
+        return assignment, totals
+    
+    def greedy_initial_allocation(self, order, assignment=None, totals=None):
+        """贪心初始分配：按 order 给出的发票下标顺序，每张发票分给使总得分最低的人
+
+        总得分只在接收发票的那个人身上变化，因此只需比较该人得分项的
+        增量；每人的额度和上限在循环前计算一次。传入 assignment 和 totals
+        时在已有分配的基础上继续分配（原地修改）。返回 (assignment, totals)。
+        人数不少于 GREEDY_HEAP_MIN_PEOPLE 时改用 heap_greedy_allocation。
+        """
+        if len(self.allocations) >= GREEDY_HEAP_MIN_PEOPLE:
+            return self.heap_greedy_allocation(order, assignment, totals)
+        
+        cents = self.invoices.cents
+        if assignment is None:
+            assignment = array('i', [-1]) * len(cents)
+            totals = [0] * len(self.allocations)
+        
+        people = [(p, quota, self.get_bounds_cents(quota)[2])
+                  for p, quota in enumerate(self.allocations.values())]
+        terms = [self.calculate_score(totals[p] / 100, quota) for p, quota, _ in people]
+        
+        for idx in order:
+            amount = cents[idx]
+            best_person = -1
+            best_delta = float('inf')
+            
+            for p, quota, max_cents in people:
+                new_total = totals[p] + amount
+                if new_total <= max_cents:
+                    delta = self.calculate_score(new_total / 100, quota) - terms[p]
+                    if delta < best_delta:
+                        best_delta = delta
+                        best_person = p
+            
+            if best_person >= 0:
+                assignment[idx] = best_person
+                totals[best_person] += amount
+                terms[best_person] = self.calculate_score(
+                    totals[best_person] / 100, people[best_person][1])
+        
+        return assignment, totals
+    
+    def heap_greedy_allocation(self, order, assignment=None, totals=None):
+        """人数较多时的贪心初始分配：人员按缺口放在优先队列中
+
+        堆中以 (当前金额 - 额度) 为键，缺口最大的人在堆顶。每张发票从堆顶
+        依次取人，取到 GREEDY_HEAP_PROBE 个能接收的人后按得分增量选出最佳者，
+        其余放回堆中。上限余量不足以接收当前发票的人移到按余量排序的等待堆，
+        直到出现不超过其余量的发票时才放回，因此每人每次进出堆只需 O(log P)，
+        不会被每张发票反复取出。上限余量小于剩余发票最小金额的人不可能再
+        接收发票，直接移出。参数和返回值与 greedy_initial_allocation 相同。
+        """
+        cents = self.invoices.cents
+        if assignment is None:
+            assignment = array('i', [-1]) * len(cents)
+            totals = [0] * len(self.allocations)
+        
+        quotas = list(self.allocations.values())
+        bounds = [self.get_bounds_cents(quota) for quota in quotas]
+        targets = [target for target, _, _ in bounds]
+        highs = [high for _, _, high in bounds]
+        terms = [self.calculate_score(totals[p] / 100, quota) for p, quota in enumerate(quotas)]
+        
+        # smallest[k] 为 order[k:] 中的最小金额
+        smallest = [0] * len(order)
+        minimum = float('inf')
+        for k in range(len(order) - 1, -1, -1):
+            minimum = min(minimum, cents[order[k]])
+            smallest[k] = minimum
+        
+        heap = [(totals[p] - targets[p], p) for p in range(len(quotas))]
+        heapq.heapify(heap)
+        # 等待堆：(-上限余量, 人)，余量最大的人在堆顶；等待期间余量不变
+        waiting = []
+        
+        for k, idx in enumerate(order):
+            amount = cents[idx]
+            while waiting and -waiting[0][0] >= amount:
+                _, p = heapq.heappop(waiting)
+                heapq.heappush(heap, (totals[p] - targets[p], p))
+            
+            popped = []
+            eligible = 0
+            best_person = -1
+            best_delta = float('inf')
+            
+            while heap and eligible < GREEDY_HEAP_PROBE:
+                _, p = heapq.heappop(heap)
+                slack = highs[p] - totals[p]
+                if slack < smallest[k]:
+                    continue
+                if amount > slack:
+                    heapq.heappush(waiting, (-slack, p))
+                    continue
+                popped.append(p)
+                eligible += 1
+                delta = self.calculate_score((totals[p] + amount) / 100, quotas[p]) - terms[p]
+                if delta < best_delta:
+                    best_delta = delta
+                    best_person = p
+            
+            if best_person >= 0:
+                assignment[idx] = best_person
+                totals[best_person] += amount
+                terms[best_person] = self.calculate_score(
+                    totals[best_person] / 100, quotas[best_person])
+            for p in popped:
+                heapq.heappush(heap, (totals[p] - targets[p], p))
+        
+        return assignment, totals
+    
+    def reallocate(self, allocation, added=(), removed=(), quotas=None,
+                   lower_bound=None, upper_bound=None):
+        """在上一次的分配方案上增量重新分配（热启动）
+
+        allocation: 上一次的方案 {人名: [(文件名, 金额), ...]}
+        added: 新增的发票 [(文件名, 金额), ...]
+        removed: 移除的发票文件名
+        quotas: 额度变化 {人名: 新额度}，新额度为 None 表示移除此人，
+                原来没有的人名表示新增人员
+        lower_bound, upper_bound: 新的分配范围参数
+
+        只修复受影响的人（额度或范围变化、失去发票、新增人员）：超出上限的
+        先退回发票，再把新增、退回和被移除人员的发票贪心分配（只分给能使
+        自己得分项下降的人，上一次未使用的发票保持不用），最后从该状态开始
+        局部优化，且局部优化只从涉及受影响人员的人对开始。仍低于下限的人
+        可以从未使用的发票中补充；调整后仍不满足要求时改为调用
+        find_optimal_allocation 重新计算。返回 (allocation, amounts)。
+        """
+        start = time.perf_counter()
+        affected = set()
+        # 发票或人员变化后，上一次可行性预检查的结果不再适用
+        self.blocked = None
+        self.unusable = frozenset()
+        
+        if lower_bound is not None or upper_bound is not None:
+            self.lower_bound = lower_bound if lower_bound is not None else self.lower_bound
+            self.upper_bound = upper_bound if upper_bound is not None else self.upper_bound
+            affected.update(self.allocations)
+        
+        for name, quota in (quotas or {}).items():
+            if quota is None:
+                self.allocations.pop(name, None)
+                if name in self.people:
+                    self.people.remove(name)
+                affected.discard(name)
+                continue
+            if name not in self.allocations:
+                self.people.append(name)
+            self.allocations[name] = quota
+            affected.add(name)
         
+        # 更新发票列表，失去发票的人也受影响
+        owner = {filename: name for name, invoices in allocation.items() for filename, _ in invoices}
+        removed = set(removed)
+        for filename in removed:
+            if owner.get(filename) in self.allocations:
+                affected.add(owner[filename])
+        invoices = InvoiceList(invoice for invoice in self.invoices if invoice[0] not in removed)
+        for invoice in added:
+            invoices.append(invoice)
+        self.invoices = invoices
+        
+        # 由上一次的方案恢复分配向量
+        names = list(self.allocations)
+        index = {name: p for p, name in enumerate(names)}
+        cents = self.invoices.cents
+        assignment = array('i', [-1]) * len(cents)
+        totals = [0] * len(names)
+        for idx, filename in enumerate(self.invoices.names):
+            p = index.get(owner.get(filename), -1)
+            if p >= 0:
+                assignment[idx] = p
+                totals[p] += cents[idx]
+        
+        # 需要重新分配的发票：新增的发票和被移除人员的发票
+        pending = set(range(len(cents) - len(added), len(cents)))
+        pending.update(idx for idx, filename in enumerate(self.invoices.names)
+                       if filename in owner and owner[filename] not in index)
+        
+        # 超出上限的人退回发票：每次退回金额最接近超出目标部分的一张
+        focus = {index[name] for name in affected}
+        for p in focus:
+            target, _, high = self.get_bounds_cents(self.allocations[names[p]])
+            while totals[p] > high:
+                excess = totals[p] - target
+                idx = min((i for i, owner_p in enumerate(assignment) if owner_p == p),
+                          key=lambda i: abs(cents[i] - excess))
+                assignment[idx] = -1
+                totals[p] -= cents[idx]
+                pending.add(idx)
+        
+        # 待分配的发票按金额从大到小，分给得分项（range_score）下降最多的人
+        quotas = list(self.allocations.values())
+        bounds = [self.get_bounds_cents(quota) for quota in quotas]
+        
+        def term(p, total):
+            _, low, high = bounds[p]
+            return self.range_score(total, quotas[p], low, high)
+        
+        def place(indices, people):
+            for idx in sorted(indices, key=cents.__getitem__, reverse=True):
+                amount = cents[idx]
+                best_person = -1
+                best_delta = 0
+                for p in people:
+                    if totals[p] + amount <= bounds[p][2]:
+                        delta = term(p, totals[p] + amount) - term(p, totals[p])
+                        if delta < best_delta:
+                            best_delta = delta
+                            best_person = p
+                if best_person >= 0:
+                    assignment[idx] = best_person
+                    totals[best_person] += amount
+                    focus.add(best_person)
+        
+        place(pending, range(len(names)))
+        # 仍低于下限的人（如额度提高或新增人员）再从未使用的发票中补充
+        below = [p for p in range(len(names)) if totals[p] < bounds[p][1]]
+        if below:
+            place([idx for idx, p in enumerate(assignment) if p < 0], below)
+        
+        self.local_search(assignment, totals, focus=focus)
+        
+        allocation, amounts = self.allocation_from_assignment(assignment)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"增量调整完成（{len(focus)} 人受影响），用时 {elapsed:.1f} 毫秒，"
+              f"得分: {self.total_score(amounts):.4f}")
+        if not self.is_valid_allocation(amounts):
+            print("增量调整后仍有人不满足要求，改为重新计算完整方案")
+            return self.find_optimal_allocation()
+        return allocation, amounts
+    
+    def detect_invoice_changes(self):
+        """重新扫描发票文件夹，返回与当前发票列表相比的 (新增发票, 移除的文件名)"""
+        current = set(self.invoices.names)
+        found = {}
+        cache = ScanCache.for_folder(self.folder_path)
+        for filename, amount in self.iter_invoices(self.folder_path, self.recursive, cache):
+            found[filename] = amount
+        cache.save()
+        added = [(filename, amount) for filename, amount in found.items() if filename not in current]
+        removed = [filename for filename in current if filename not in found]
+        if added:
+            # 新增的文件与已有发票内容相同时不参与分配
+            duplicates = find_duplicate_files(
+                self.folder_path, [f for f in self.invoices.names if f in found]
+                + sorted((filename for filename, _ in added), key=lambda f: (len(f), f)))
+            added = [invoice for invoice in added if invoice[0] not in duplicates]
+        if self.ledger is not None and added:
+            allocated = self.allocated_filenames([filename for filename, _ in added])
+            added = [invoice for invoice in added if invoice[0] not in allocated]
+        return added, removed
+    
+    def collapse_duplicates(self, workers=HASH_WORKERS):
+        """从发票列表中排除内容完全相同的重复发票，返回被排除的文件名
+
+        浏览器重复下载的 "张三 200 (1).pdf" 等副本与原文件内容相同，不排除
+        会被当作不同的发票分配给不同的人。每组重复文件保留文件名最短的一个。
+        """
+        names = sorted(self.invoices.names, key=lambda f: (len(f), f))
+        duplicates = find_duplicate_files(self.folder_path, names, workers)
+        if not duplicates:
+            return []
+        self.invoices = InvoiceList(invoice for invoice in self.invoices
+                                    if invoice[0] not in duplicates)
+        print(f"发现 {len(duplicates)} 张内容重复的发票，已排除:")
+        for filename, original in itertools.islice(duplicates.items(), 10):
+            print(f"  {filename}（与 {original} 相同）")
+        if len(duplicates) > 10:
+            print(f"  ... 等 {len(duplicates)} 张")
+        return list(duplicates)
+    
+    def allocated_filenames(self, filenames, workers=HASH_WORKERS):
+        """返回 filenames 中已记录在台账里的发票
+
+        先按文件大小查询台账，只有大小与已分配发票相同的文件才需要计算哈希。
+        """
+        sizes = {}
+        for filename in filenames:
+            try:
+                sizes[filename] = os.path.getsize(os.path.join(self.folder_path, filename))
+            except OSError:
+                continue
+        known = self.ledger.known_sizes(sizes.values())
+        candidates = [filename for filename, size in sizes.items() if size in known]
+        if not candidates:
+            return set()
+        digests = hash_files([os.path.join(self.folder_path, f) for f in candidates], workers)
+        allocated = self.ledger.allocated(digest for digest in digests if digest)
+        return {filename for filename, digest in zip(candidates, digests) if digest in allocated}
+    
+    def record_allocation(self, allocation, workers=HASH_WORKERS):
+        """把分配方案中的发票写入台账，返回批次编号"""
+        invoices = [(name, filename, amount) for name in self.people
+                    for filename, amount in allocation[name]]
+        paths = [os.path.join(self.folder_path, filename) for _, filename, _ in invoices]
+        digests = hash_files(paths, workers)
+        rows = []
+        for (name, filename, amount), path, digest in zip(invoices, paths, digests):
+            if digest is not None:
+                rows.append((digest, os.path.getsize(path), to_cents(amount), filename, name))
+        return self.ledger.record_run(self.folder_path, rows)
+    
+    def allocation_from_assignment(self, assignment):
+        """由分配向量生成 (allocation, amounts)：每人的发票列表及分配金额（元）"""
+        names = list(self.allocations)
+        allocation = {name: [] for name in names}
+        totals = [0] * len(names)
+        for idx, (p, amount) in enumerate(zip(assignment, self.invoices.cents)):
+            if p >= 0:
+                allocation[names[p]].append(self.invoices[idx])
+                totals[p] += amount
+        amounts = {name: totals[p] / 100 for p, name in enumerate(names)}
+        return allocation, amounts
+    
+    def assignment_from_allocation(self, allocation):
+        """由 {人名: [(文件名, 金额), ...]} 恢复分配向量"""
+        index = {filename: idx for idx, filename in enumerate(self.invoices.names)}
+        assignment = array('i', [-1]) * len(self.invoices)
+        for p, name in enumerate(self.allocations):
+            for filename, _ in allocation.get(name, []):
+                assignment[index[filename]] = p
+        return assignment
+    
+    def display_solution(self, allocation, amounts, detail=None, report_path=None):
+        """显示解决方案
+
+        detail: "full" 列出每人的全部发票；"people" 每人一行；"summary" 只显示
+                总体评估和不符合要求的人。None 时按发票数和人数自动选择
+        report_path: 指定时把完整方案写入该文件（见 write_report）
+        输出先在内存中拼接，最后一次写出。
+        """
+        names = list(self.allocations)
+        if detail is None:
+            if len(self.invoices) <= REPORT_FULL_MAX_INVOICES:
+                detail = "full"
+            elif len(names) <= REPORT_PEOPLE_MAX:
+                detail = "people"
+            else:
+                detail = "summary"
+        assignment = self.assignment_from_allocation(allocation)
+        
+        lines = ["", "=" * 60, "最优分配方案", "=" * 60]
         total_score = 0
-        all_valid = True
         total_used = 0
         total_invoices_used = 0
-        
-        # 计算超额人数
         excess_count = 0
-        for name in self.people:
-            target = self.allocations[name]
-            actual = amounts[name]
-            if actual > target:
-                excess_count += 1
+        invalid = []
         
-        for name in self.people:
+        for name in names:
             target = self.allocations[name]
             actual = amounts[name]
             min_amount = target * self.lower_bound
             max_amount = target * self.upper_bound
             deviation = actual - target
             deviation_percent = (deviation / target) * 100 if target > 0 else 0
+            valid = min_amount <= actual <= max_amount
+            invoices = allocation[name]
             
-            status = "✅" if actual > target else "⚠️" if actual >= target else "❌"
-            print(f"\n{name} {status}:")
-            print(f"  目标额度: {target:.2f}元")
-            print(f"  实际分配: {actual:.2f}元")
-            print(f"  允许范围: {min_amount:.2f}元 - {max_amount:.2f}元")
-            print(f"  偏差: {deviation:+.2f}元 ({deviation_percent:+.2f}%)")
-            
-            # 检查是否满足约束
-            if min_amount <= actual <= max_amount:
-                print("  ✅ 分配符合要求")
-            else:
-                print("  ⚠️ 分配不符合要求！")
-                all_valid = False
-            
-            print(f"  分配的发票 ({len(allocation[name])}张):")
-            for filename, amount in allocation[name]:
-                print(f"    - {filename} ({amount:.2f}元)")
-                total_used += amount
-                total_invoices_used += 1
-            
+            if actual > target:
+                excess_count += 1
+            if not valid:
+                invalid.append(name)
+            total_used += actual
+            total_invoices_used += len(invoices)
             total_score += self.calculate_score(actual, target)
+            
+            status = "✅" if actual > target else "⚠️" if actual >= target else "❌"
+            if detail == "full":
+                lines.append(f"\n{name} {status}:")
+                lines.append(f"  目标额度: {target:.2f}元")
+                lines.append(f"  实际分配: {actual:.2f}元")
+                lines.append(f"  允许范围: {min_amount:.2f}元 - {max_amount:.2f}元")
+                lines.append(f"  偏差: {deviation:+.2f}元 ({deviation_percent:+.2f}%)")
+                lines.append("  ✅ 分配符合要求" if valid else "  ⚠️ 分配不符合要求！")
+                lines.append(f"  分配的发票 ({len(invoices)}张):")
+                lines.extend(f"    - {filename} ({amount:.2f}元)" for filename, amount in invoices)
+            elif detail == "people":
+                lines.append(f"{name} {status}: {actual:.2f}/{target:.2f}元 "
+                             f"({deviation_percent:+.2f}%)，{len(invoices)}张"
+                             + ("" if valid else "  ⚠️ 不符合要求"))
         
         # 显示未使用的发票
-        used_invoices = set()
-        for invoices in allocation.values():
-            for filename, _ in invoices:
-                used_invoices.add(filename)
+        unused = [idx for idx, p in enumerate(assignment) if p < 0]
+        if unused and detail == "full":
+            lines.append(f"\n未使用的发票 ({len(unused)}张):")
+            lines.extend(f"  - {self.invoices.names[idx]} ({self.invoices.cents[idx] / 100:.2f}元)"
+                         for idx in unused)
         
-        unused_invoices = [(f, a) for f, a in self.invoices if f not in used_invoices]
+        lines.append("\n" + "=" * 60)
+        lines.append("总体评估:")
+        lines.append(f"使用的发票数量: {total_invoices_used}/{len(self.invoices)}")
+        lines.append(f"使用的总金额: {total_used:.2f}元")
+        lines.append(f"超额人数: {excess_count}/{len(names)}")
+        lines.append(f"总得分: {total_score:.4f}")
         
-        if unused_invoices:
-            print(f"\n未使用的发票 ({len(unused_invoices)}张):")
-            for filename, amount in unused_invoices:
-                print(f"  - {filename} ({amount:.2f}元)")
-        
-        print("\n" + "="*60)
-        print(f"总体评估:")
-        print(f"使用的发票数量: {total_invoices_used}/{len(self.invoices)}")
-        print(f"使用的总金额: {total_used:.2f}元")
-        print(f"超额人数: {excess_count}/{len(self.people)}")
-        print(f"总得分: {total_score:.4f}")
-        
-        if all_valid:
-            print("✅ 所有分配均满足要求！")
+        if not invalid:
+            lines.append("✅ 所有分配均满足要求！")
         else:
-            print("⚠️ 部分分配未满足要求")
+            lines.append("⚠️ 部分分配未满足要求")
+            if detail == "summary":
+                shown = "、".join(invalid[:10]) + (f" 等 {len(invalid)} 人" if len(invalid) > 10 else "")
+                lines.append(f"不符合要求: {shown}")
+        print("\n".join(lines))
+        
+        if report_path is not None:
+            self.write_report(assignment, report_path)
+            print(f"完整方案已写入: {report_path}")
         
         return allocation
     
-    def process_files(self, allocation):
-        """处理文件：创建文件夹、复制并重命名发票文件"""
+    def write_report(self, assignment, path):
+        """把方案流式写入报告文件：.jsonl 为 JSON Lines，其他为 CSV
+
+        只遍历一次分配向量，逐张写出发票记录（未使用的发票人员为空），
+        同时累计每人的金额和张数，最后写出每人的汇总记录。通过
+        REPORT_BUFFER_BYTES 大小的缓冲区写入。两种格式的字段相同，
+        CSV 中不适用于该类记录的列留空。
+        """
+        names = list(self.allocations)
+        counts = [0] * len(names)
+        totals = [0] * len(names)
+        jsonl = path.lower().endswith(".jsonl")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        
+        with open(path, "w", encoding="utf-8" if jsonl else "utf-8-sig", newline="",
+                  buffering=REPORT_BUFFER_BYTES) as f:
+            if jsonl:
+                def write_row(row):
+                    f.write(json.dumps(row, ensure_ascii=False))
+                    f.write("\n")
+            else:
+                writer = csv.writer(f)
+                writer.writerow(["记录", "人员", "文件", "金额", "发票数", "额度", "下限", "上限",
+                                 "符合要求", "得分"])
+            
+            for filename, amount, p in zip(self.invoices.names, self.invoices.cents, assignment):
+                if p >= 0:
+                    counts[p] += 1
+                    totals[p] += amount
+                person = names[p] if p >= 0 else ""
+                if jsonl:
+                    write_row({"type": "invoice", "person": person or None, "file": filename,
+                               "amount": amount / 100})
+                else:
+                    writer.writerow(["发票", person, filename, f"{amount / 100:.2f}",
+                                     "", "", "", "", "", ""])
+            
+            for p, name in enumerate(names):
+                quota = self.allocations[name]
+                _, low, high = self.get_bounds_cents(quota)
+                valid = low <= totals[p] <= high
+                score = self.calculate_score(totals[p] / 100, quota)
+                if jsonl:
+                    write_row({"type": "person", "person": name, "quota": quota,
+                               "amount": totals[p] / 100, "invoices": counts[p],
+                               "low": low / 100, "high": high / 100, "valid": valid,
+                               "score": score})
+                else:
+                    writer.writerow(["人员", name, "", f"{totals[p] / 100:.2f}", counts[p],
+                                     f"{quota:.2f}", f"{low / 100:.2f}", f"{high / 100:.2f}",
+                                     "是" if valid else "否", f"{score:.4f}"])
+    
+    def process_files(self, allocation, mode="copy", workers=OUTPUT_WORKERS, dry_run=False):
+        """处理文件：创建文件夹、复制并重命名发票文件
+
+        mode: "copy" 复制；"hardlink" 硬链接；"reflink" 写时复制克隆。
+              链接方式在同一磁盘上不会复制数据，不支持时自动退回复制
+        workers: 并发处理文件的线程数
+        dry_run: 只写出清单 manifest.csv，不生成任何发票文件
+        """
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f"未知的输出方式: {mode}")
+        
         print("\n" + "="*60)
         print("开始处理发票文件...")
         print("="*60)
         
         # 创建输出目录
-        output_dir = os.path.join(self.folder_path, "发票分配结果")
+        output_dir = os.path.join(self.folder_path, OUTPUT_DIR_NAME)
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
             print(f"创建输出目录: {output_dir}")
         
-        # 为每个人创建文件夹并处理文件
+        # 为每个人创建文件夹并规划目标文件名
+        tasks = []
         for name in self.people:
             # 创建个人文件夹
             person_dir = os.path.join(output_dir, name)
-            if not os.path.exists(person_dir):
+            if not dry_run and not os.path.exists(person_dir):
                 os.makedirs(person_dir)
                 print(f"创建个人文件夹: {person_dir}")
             
-            # 处理该人的所有发票文件
-            file_count = 0
+            used_names = set()
             for filename, amount in allocation[name]:
-                # 构建新文件名（将原文件名中的人名替换为分配的人名）
-                new_filename = self.rename_invoice_file(filename, name)
-                
-                # 源文件路径
+                # 构建新文件名（将原文件名中的人名替换为分配的人名），
+                # 同名时追加序号，避免不同发票互相覆盖
+                new_filename = unique_filename(self.rename_invoice_file(filename, name), used_names)
                 source_path = os.path.join(self.folder_path, filename)
-                
-                # 目标文件路径
                 dest_path = os.path.join(person_dir, new_filename)
-                
-                # 复制文件
+                tasks.append((name, filename, amount, new_filename, source_path, dest_path))
+        
+        manifest_path = os.path.join(output_dir, "manifest.csv")
+        with open(manifest_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["人员", "原文件", "新文件", "金额"])
+            for name, filename, amount, new_filename, _, _ in tasks:
+                writer.writerow([name, filename, f"{name}/{new_filename}", f"{amount:.2f}"])
+        
+        if dry_run:
+            print(f"试运行：未生成文件，清单已写入 {manifest_path}（共 {len(tasks)} 个文件）")
+            return output_dir
+        
+        # 使用线程池并发生成文件，只在结束时汇总
+        file_counts = {name: 0 for name in self.people}
+        mode_counts = {}
+        total_bytes = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(materialize_file, task[4], task[5], mode): task
+                       for task in tasks}
+            for future in as_completed(futures):
+                name, filename, _, new_filename, _, _ = futures[future]
                 try:
-                    shutil.copy2(source_path, dest_path)
-                    print(f"复制: {filename} -> {name}/{new_filename}")
-                    file_count += 1
+                    used_mode, size = future.result()
                 except Exception as e:
                     print(f"错误: 无法复制文件 {filename} -> {new_filename}: {str(e)}")
-            
-            print(f"{name} 文件夹: 成功复制 {file_count} 个文件")
+                    continue
+                file_counts[name] += 1
+                mode_counts[used_mode] = mode_counts.get(used_mode, 0) + 1
+                total_bytes += size
+        elapsed = time.perf_counter() - start
+        
+        for name in self.people:
+            print(f"{name} 文件夹: 成功处理 {file_counts[name]} 个文件")
+        
+        done = sum(file_counts.values())
+        megabytes = total_bytes / (1 << 20)
+        rate = elapsed if elapsed > 0 else float('inf')
+        print(f"\n共处理 {done}/{len(tasks)} 个文件，{megabytes:.1f} MB，用时 {elapsed:.2f} 秒"
+              f"（{done / rate:.0f} 个/秒，{megabytes / rate:.1f} MB/秒）")
+        if mode != "copy":
+            names = {"copy": "复制", "hardlink": "硬链接", "reflink": "克隆"}
+            print("方式: " + "，".join(f"{names[m]} {c} 个" for m, c in mode_counts.items()))
         
         print(f"\n所有文件处理完成！结果保存在: {output_dir}")
         return output_dir
     
     def rename_invoice_file(self, filename, new_person_name):
         """重命名发票文件，将原文件名中的人名替换为新的人名"""
-        # 移除文件扩展名
-        name_without_ext, ext = os.path.splitext(filename)
+        # 移除目录和文件扩展名
+        name_without_ext, ext = os.path.splitext(os.path.basename(filename))
         
         # 提取金额部分（假设金额在文件名最后）
         # 使用正则表达式匹配金额和可能的副本标记
-        amount_pattern = re.compile(r'(\d+\.?\d*)\s*(?:\(\d+\))?$')
-        match = amount_pattern.search(name_without_ext)
+        match = RENAME_AMOUNT_PATTERN.search(name_without_ext)
         
         if match:
             # 提取金额部分
@@ -551,14 +3110,27 @@ class InvoiceAllocator:
             # 获取用户输入
             self.get_user_input()
             
+            # 打开发票台账，之前分配过的发票不再参与分配
+            self.ledger = InvoiceLedger()
+            # 长时间的求解定期保存检查点，中断后再次运行时继续
+            self.checkpoint_dir = os.path.join(cache_dir(), "checkpoints")
+            
             # 扫描发票文件
             if not self.scan_invoices():
                 return
             
             # 主循环，允许重新计算
+            warm_start = None
+            use_cache = True
             while True:
-                # 寻找最优分配
-                allocation, amounts = self.find_optimal_allocation()
+                # 寻找最优分配；发票有变化时使用增量调整的结果；
+                # 用户要求重新计算时不使用缓存的方案
+                if warm_start is not None:
+                    allocation, amounts = warm_start
+                    warm_start = None
+                else:
+                    allocation, amounts = self.find_optimal_allocation(use_cache=use_cache)
+                use_cache = False
                 
                 if allocation is None:
                     print("无法找到满足要求的分配方案！")
@@ -566,8 +3138,11 @@ class InvoiceAllocator:
                         break
                     continue
                 
-                # 显示方案
-                allocation = self.display_solution(allocation, amounts)
+                # 显示方案；发票很多时控制台只显示摘要，完整方案写入报告文件
+                report_path = None
+                if len(self.invoices) > REPORT_FULL_MAX_INVOICES:
+                    report_path = os.path.join(self.folder_path, OUTPUT_DIR_NAME, REPORT_FILE_NAME)
+                allocation = self.display_solution(allocation, amounts, report_path=report_path)
                 
                 # 询问用户操作
                 print("\n请选择操作:")
@@ -583,6 +3158,8 @@ class InvoiceAllocator:
                         print(f"\n处理完成！")
                         print(f"分配的发票已复制到: {output_dir}")
                         print(f"每个人对应的文件夹中，文件名已更新为对应的人名")
+                        run_id = self.record_allocation(allocation)
+                        print(f"已记录到发票台账（批次 {run_id}），之后的扫描将跳过这些发票")
                         
                         # 询问是否继续
                         if self.confirm_action("\n是否重新计算新的分配方案？(y/n): "):
@@ -590,7 +3167,12 @@ class InvoiceAllocator:
                         else:
                             return
                     elif choice == '2':
-                        # 重新计算
+                        # 重新计算；文件夹中的发票有变化时在当前方案上增量调整
+                        added, removed = self.detect_invoice_changes()
+                        if added or removed:
+                            print(f"检测到发票变化：新增 {len(added)} 张，移除 {len(removed)} 张，"
+                                  f"在当前方案上增量调整...")
+                            warm_start = self.reallocate(allocation, added=added, removed=removed)
                         break
                     elif choice == '3':
                         # 退出程序
@@ -0,0 +1,127 @@
+"""批量分配：一次运行处理多个部门的发票文件夹和额度
+
+从 JSONL 或 CSV 文件读取任务，在同一个进程池中并行扫描和求解，
+每个任务写出一份 JSON 报告，最后输出汇总。
+
+JSONL 每行一个任务，字段与 service.py 的任务 JSON 相同，另可指定
+"name"（报告名称）：
+    {"name": "财务部", "folder": "发票/财务部", "allocations": {"甲": 200, "乙": 150}}
+
+CSV 需要表头，people 列的格式与交互输入相同（人名 额度 人名 额度 ...）：
+    name,folder,people,lower_bound,upper_bound,method,seed,time_budget,recursive
+    财务部,发票/财务部,甲 200 乙 150,0.97,1.03,,,,
+
+示例：
+    python batch.py jobs.jsonl -o 批量分配报告 --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from service import solve_job
+
+# CSV 中数值类型的列
+CSV_FLOAT_FIELDS = ("lower_bound", "upper_bound", "time_budget", "target_score")
+CSV_INT_FIELDS = ("seed",)
+
+
+def parse_people(text):
+    """解析 "甲 200 乙 150" 形式的人名和额度"""
+    parts = text.split()
+    if not parts or len(parts) % 2:
+        raise ValueError(f"人名和额度格式错误: {text!r}")
+    return {parts[i]: float(parts[i + 1]) for i in range(0, len(parts), 2)}
+
+
+def read_jobs(path):
+    """读取任务文件（.csv 为 CSV，其他为 JSONL），返回任务列表"""
+    jobs = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                job = {key: value.strip() for key, value in row.items()
+                       if key and value and value.strip()}
+                if "people" in job:
+                    job["allocations"] = parse_people(job.pop("people"))
+                for key in CSV_FLOAT_FIELDS:
+                    if key in job:
+                        job[key] = float(job[key])
+                for key in CSV_INT_FIELDS:
+                    if key in job:
+                        job[key] = int(job[key])
+                if "recursive" in job:
+                    job["recursive"] = job["recursive"].lower() in ("1", "true", "yes", "y")
+                jobs.append(job)
+        else:
+            for line in f:
+                if line.strip():
+                    jobs.append(json.loads(line))
+    return jobs
+
+
+def report_name(job, index, used_names):
+    """报告文件名：优先使用任务名称，其次为文件夹名"""
+    folder = job.get("folder")
+    name = job.get("name") or (folder and os.path.basename(os.path.normpath(folder))) or "任务"
+    name = re.sub(r'[\\/:*?"<>|]', "_", str(name))
+    candidate = f"{index + 1:03d}-{name}"
+    while candidate in used_names:
+        candidate += "_"
+    used_names.add(candidate)
+    return candidate + ".json"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量发票分配")
+    parser.add_argument("jobs", help="任务文件（JSONL 或 CSV）")
+    parser.add_argument("-o", "--output-dir", default="批量分配报告", help="报告输出目录")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数（默认使用全部 CPU）")
+    args = parser.parse_args(argv)
+
+    jobs = read_jobs(args.jobs)
+    if not jobs:
+        print("任务文件中没有任务")
+        return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+    used_names = set()
+    names = [report_name(job, index, used_names) for index, job in enumerate(jobs)]
+
+    start = time.perf_counter()
+    failed = 0
+    print(f"共 {len(jobs)} 个任务，开始处理...")
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(solve_job, job): index for index, job in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"event": "error", "message": str(e)}
+            result.pop("event", None)
+            report = {"job": jobs[index], **result}
+            with open(os.path.join(args.output_dir, names[index]), "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+            if "message" in result:
+                status = f"失败：{result['message']}"
+            elif not result["feasible"]:
+                status = "不存在满足要求的分配方案"
+            else:
+                status = f"得分 {result['score']:.4f}{'' if result['valid'] else '（有人超出范围）'}"
+            if "message" in result or not result.get("valid"):
+                failed += 1
+            print(f"[{done}/{len(jobs)}] {names[index]}: {status}")
+
+    elapsed = time.perf_counter() - start
+    print(f"\n完成 {len(jobs)} 个任务，用时 {elapsed:.1f} 秒，其中 {failed} 个未得到有效方案")
+    print(f"报告已保存到: {args.output_dir}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+"""发票分配算法的基准测试
+
+用固定种子生成不同规模的模拟发票批次，运行 find_optimal_allocation，
+记录用时、峰值内存、最终得分和有效方案比例，结果写入 JSON 文件。
+指定 --compare 时与保存的基准结果对比，速度或质量退化时以非零状态退出。
+
+示例：
+    python benchmark.py --quick -o baseline.json
+    python benchmark.py --quick --compare baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from InvoiceAllocator import SOLVER_STRATEGIES, InvoiceAllocator, SolverStats
+
+# 默认测试规模（发票数, 人数）
+DEFAULT_SIZES = [(10, 2), (30, 3), (100, 5), (300, 10), (1000, 30),
+                 (3000, 100), (10000, 500)]
+QUICK_SIZES = [(10, 2), (30, 3), (100, 5), (300, 10)]
+DISTRIBUTIONS = ("uniform", "lognormal", "mixed")
+
+# 判定用时退化所需的最小绝对增加量（秒）
+MIN_TIME_DELTA = 0.05
+
+
+def random_amount(rng, distribution):
+    """按指定分布生成一张发票的金额（元，两位小数）"""
+    if distribution == "mixed":
+        # 大部分为小额票据，少量中等金额和整百的大额发票
+        r = rng.random()
+        distribution = "lognormal" if r < 0.7 else "uniform" if r < 0.9 else "round"
+    if distribution == "uniform":
+        amount = rng.uniform(20, 2000)
+    elif distribution == "lognormal":
+        amount = min(rng.lognormvariate(4.5, 1.0), 5000)
+    else:
+        amount = rng.randrange(10, 51) * 100
+    return round(max(amount, 1.0), 2)
+
+
+def generate_instance(num_invoices, num_people, seed, distribution="mixed", fill=0.9):
+    """生成一个模拟分配问题
+
+    各人额度按随机权重分配，总额度为发票总额的 fill 倍。
+    返回 (发票列表, 额度字典)。
+    """
+    rng = random.Random(f"{seed}-{num_invoices}-{num_people}-{distribution}")
+    invoices = [(f"发票{i:05d} {amount}.pdf", amount)
+                for i, amount in ((i, random_amount(rng, distribution))
+                                  for i in range(num_invoices))]
+    total = sum(amount for _, amount in invoices)
+    weights = [rng.uniform(0.5, 1.5) for _ in range(num_people)]
+    scale = total * fill / sum(weights)
+    allocations = {f"人员{p:03d}": round(w * scale, 2) for p, w in enumerate(weights)}
+    return invoices, allocations
+
+
+def build_allocator(invoices, allocations, lower_bound, upper_bound):
+    """用生成的问题构造分配器"""
+    allocator = InvoiceAllocator()
+    allocator.invoices = invoices
+    allocator.people = list(allocations)
+    allocator.allocations = dict(allocations)
+    allocator.lower_bound = lower_bound
+    allocator.upper_bound = upper_bound
+    return allocator
+
+
+def solve(allocator, args, seed):
+    """运行一次求解（屏蔽求解过程的输出），返回 (用时秒数, 得分, 是否有效)
+
+    已证明无解时得分为 None。
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, amounts = allocator.find_optimal_allocation(
+            method=args.method, workers=args.workers, seed=seed,
+            time_budget=args.time_budget, use_cache=False)
+    elapsed = time.perf_counter() - start
+    if amounts is None:
+        return elapsed, None, False
+    return elapsed, allocator.total_score(amounts), allocator.is_valid_allocation(amounts)
+
+
+def run_case(num_invoices, num_people, distribution, args):
+    """对一种规模和分布运行 args.repeat 次，返回汇总结果
+
+    计时运行时不启用 tracemalloc（避免拖慢求解），峰值内存在
+    第一个实例上单独测量一次；多进程时只统计主进程的内存。
+    """
+    runs = []
+    peak_mb = None
+    for r in range(args.repeat):
+        seed = args.seed + r
+        invoices, allocations = generate_instance(num_invoices, num_people, seed,
+                                                  distribution, args.fill)
+        allocator = build_allocator(invoices, allocations, args.lower, args.upper)
+        if args.stats:
+            allocator.stats = SolverStats()
+        elapsed, score, valid = solve(allocator, args, seed)
+        runs.append({"seed": seed, "wall_s": elapsed, "score": score, "valid": valid})
+        if args.stats:
+            runs[-1]["stats"] = allocator.stats.to_dict()
+
+        if r == 0 and not args.no_memory:
+            allocator = build_allocator(invoices, allocations, args.lower, args.upper)
+            tracemalloc.start()
+            solve(allocator, args, seed)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+    scores = [run["score"] for run in runs if run["score"] is not None]
+    return {
+        "invoices": num_invoices,
+        "people": num_people,
+        "distribution": distribution,
+        "wall_s": statistics.median(run["wall_s"] for run in runs),
+        "peak_mb": peak_mb,
+        "score": statistics.mean(scores) if scores else None,
+        "feasible_rate": sum(run["valid"] for run in runs) / len(runs),
+        "runs": runs,
+    }
+
+
+def case_key(case):
+    return f"{case['invoices']}x{case['people']}-{case['distribution']}"
+
+
+def compare(results, baseline, time_tolerance, score_tolerance):
+    """与基准结果对比，返回退化描述列表"""
+    previous = {case_key(case): case for case in baseline["results"]}
+    regressions = []
+
+    print(f"\n{'规模':<22}{'用时':>18}{'得分':>28}{'有效比例':>14}")
+    for case in results:
+        key = case_key(case)
+        old = previous.get(key)
+        if old is None:
+            print(f"{key:<22}（基准中无此项）")
+            continue
+
+        flags = []
+        time_ratio = case["wall_s"] / old["wall_s"] if old["wall_s"] > 0 else 1.0
+        # 极短的用时波动较大，差值不足 MIN_TIME_DELTA 秒时不视为退化
+        if (time_ratio > 1 + time_tolerance
+                and case["wall_s"] - old["wall_s"] > MIN_TIME_DELTA):
+            flags.append(f"{key} 用时退化 {old['wall_s']:.3f}s -> {case['wall_s']:.3f}s")
+        if old["score"] is not None and case["score"] is not None:
+            # 得分越低越好；基准得分为 0 时只允许绝对误差
+            allowed = old["score"] * (1 + score_tolerance) + 1e-6
+            if case["score"] > allowed:
+                flags.append(f"{key} 得分退化 {old['score']:.4f} -> {case['score']:.4f}")
+        if case["feasible_rate"] < old["feasible_rate"]:
+            flags.append(f"{key} 有效比例下降 {old['feasible_rate']:.0%} -> "
+                         f"{case['feasible_rate']:.0%}")
+
+        mark = "  <-- 退化" if flags else ""
+        score = (f"{old['score']:.2f} -> {case['score']:.2f}"
+                 if old["score"] is not None and case["score"] is not None else "-")
+        print(f"{key:<22}{time_ratio:>17.2f}x{score:>28}"
+              f"{old['feasible_rate']:>7.0%} -> {case['feasible_rate']:.0%}{mark}")
+        regressions.extend(flags)
+    return regressions
+
+
+def parse_sizes(text):
+    """解析 "100x5,1000x30" 形式的规模列表"""
+    sizes = []
+    for part in text.split(","):
+        invoices, people = part.lower().split("x")
+        sizes.append((int(invoices), int(people)))
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="发票分配算法基准测试")
+    parser.add_argument("--sizes", type=parse_sizes,
+                        help="测试规模，如 100x5,1000x30（默认使用内置规模列表）")
+    parser.add_argument("--quick", action="store_true", help="只运行小规模测试")
+    parser.add_argument("--distributions", default="mixed",
+                        help=f"金额分布，逗号分隔，可选 {', '.join(DISTRIBUTIONS)}")
+    parser.add_argument("--repeat", type=int, default=3, help="每种规模的实例数")
+    parser.add_argument("--seed", type=int, default=0, help="基础随机种子")
+    parser.add_argument("--fill", type=float, default=0.9, help="总额度占发票总额的比例")
+    parser.add_argument("--lower", type=float, default=0.97, help="下限（相对额度）")
+    parser.add_argument("--upper", type=float, default=1.03, help="上限（相对额度）")
+    parser.add_argument("--method", default="auto",
+                        choices=("auto", "exact") + tuple(SOLVER_STRATEGIES))
+    parser.add_argument("--workers", type=int, default=None, help="并行进程数")
+    parser.add_argument("--time-budget", type=float, default=None, help="每次求解的时间预算（秒）")
+    parser.add_argument("--no-memory", action="store_true", help="不测量峰值内存")
+    parser.add_argument("--stats", action="store_true",
+                        help="记录每次求解的阶段用时、计数器和最佳得分轨迹")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="结果文件")
+    parser.add_argument("--compare", metavar="BASELINE", help="与基准结果文件对比")
+    parser.add_argument("--time-tolerance", type=float, default=0.25,
+                        help="允许的用时增加比例（默认 0.25）")
+    parser.add_argument("--score-tolerance", type=float, default=0.01,
+                        help="允许的得分增加比例（默认 0.01）")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    distributions = [d.strip() for d in args.distributions.split(",")]
+    for distribution in distributions:
+        if distribution not in DISTRIBUTIONS:
+            parser.error(f"未知的金额分布: {distribution}")
+
+    results = []
+    print(f"{'规模':<22}{'用时(s)':>10}{'峰值内存(MB)':>14}{'平均得分':>18}{'有效比例':>10}")
+    for num_invoices, num_people in sizes:
+        for distribution in distributions:
+            case = run_case(num_invoices, num_people, distribution, args)
+            results.append(case)
+            peak = f"{case['peak_mb']:.1f}" if case["peak_mb"] is not None else "-"
+            score = f"{case['score']:.4f}" if case["score"] is not None else "-"
+            print(f"{case_key(case):<22}{case['wall_s']:>10.3f}{peak:>14}{score:>18}"
+                  f"{case['feasible_rate']:>10.0%}")
+
+    report = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items()
+                     if key not in ("sizes", "output", "compare")},
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_tolerance, args.score_tolerance)
+        if regressions:
+            print("\n发现退化:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\n未发现退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""在线分配：边扫描边分配发票
+
+逐张读取文件夹中的发票（或持续监视文件夹中新出现的发票），每张发票
+到达时立即分配，只保留每人的当前金额和一个小的预留池，内存占用与发票
+数量无关。扫描结束（或监视被 Ctrl-C 中断）后分配预留池并做最终调整。
+
+示例：
+    python online.py 发票 "甲 200 乙 150" -o 在线分配.csv
+    python online.py 收件箱 "甲 200 乙 150" --watch --interval 5
+"""
+import argparse
+import csv
+import sys
+
+from InvoiceAllocator import (ONLINE_POLISH_ROUNDS, ONLINE_POLL_INTERVAL, ONLINE_RESERVOIR_SIZE,
+                              InvoiceAllocator, OnlineAllocator)
+from batch import parse_people
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在线发票分配")
+    parser.add_argument("folder", help="发票文件夹")
+    parser.add_argument("people", help='人名和额度，如 "甲 200 乙 150"')
+    parser.add_argument("--recursive", action="store_true", help="扫描子文件夹")
+    parser.add_argument("--lower", type=float, default=0.97, help="下限（相对额度）")
+    parser.add_argument("--upper", type=float, default=1.03, help="上限（相对额度）")
+    parser.add_argument("--watch", action="store_true", help="持续监视新出现的发票，Ctrl-C 结束")
+    parser.add_argument("--interval", type=float, default=ONLINE_POLL_INTERVAL,
+                        help="监视时的扫描间隔（秒）")
+    parser.add_argument("--reservoir", type=int, default=ONLINE_RESERVOIR_SIZE,
+                        help="留到最后调整的小额发票张数")
+    parser.add_argument("--polish-rounds", type=int, default=ONLINE_POLISH_ROUNDS,
+                        help="最终调整的最大轮数")
+    parser.add_argument("-o", "--output", help="逐行写出分配结果的 CSV 文件")
+    parser.add_argument("--quiet", action="store_true", help="不在控制台逐张显示分配结果")
+    args = parser.parse_args(argv)
+
+    try:
+        allocations = parse_people(args.people)
+    except ValueError as e:
+        parser.error(str(e))
+    if not 0 < args.lower < 1 < args.upper:
+        parser.error("上下限必须满足 0 < lower < 1 < upper")
+
+    allocator = InvoiceAllocator()
+    allocator.allocations = allocations
+    allocator.people = list(allocations)
+    allocator.lower_bound = args.lower
+    allocator.upper_bound = args.upper
+    allocator.folder_path = args.folder
+    online = OnlineAllocator(allocator, args.reservoir)
+
+    output = open(args.output, "w", encoding="utf-8-sig", newline="") if args.output else None
+    writer = csv.writer(output) if output else None
+    if writer:
+        writer.writerow(["人员", "文件", "金额"])
+    processed = 0
+
+    def emit(placements):
+        for filename, amount, name in placements:
+            if writer:
+                writer.writerow([name or "", filename, f"{amount:.2f}"])
+            if not args.quiet:
+                print(f"{name or '（不分配）'} <- {filename} ({amount:.2f}元)")
+        if output and placements:
+            # 监视时结果应及时可见
+            output.flush()
+
+    if args.watch:
+        print(f"正在监视 {args.folder}，按 Ctrl-C 结束并进行最终调整...")
+        invoices = allocator.watch_invoices(args.folder, args.recursive, args.interval)
+    else:
+        invoices = allocator.iter_invoices(args.folder, args.recursive)
+    try:
+        for filename, amount in invoices:
+            processed += 1
+            emit(online.add(filename, amount))
+    except KeyboardInterrupt:
+        print("\n停止扫描，开始最终调整...")
+    emit(online.finish(args.polish_rounds))
+    if output:
+        output.close()
+
+    amounts = online.amounts()
+    invalid = [name for name, quota in allocations.items()
+               if not quota * args.lower <= amounts[name] <= quota * args.upper]
+    print(f"\n共处理 {processed} 张发票，{online.unused} 张未分配，"
+          f"总得分: {allocator.total_score(amounts):.4f}")
+    for p, (name, quota) in enumerate(allocations.items()):
+        mark = "" if name not in invalid else "  ⚠️ 不符合要求"
+        print(f"{name}: {amounts[name]:.2f}/{quota:.2f}元，{online.counts[p]}张{mark}")
+    if args.output:
+        print(f"分配结果已写入: {args.output}")
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""发票分配的本地服务
+
+常驻进程，通过 HTTP（或 Unix 套接字上的 HTTP）接收 JSON 格式的分配任务，
+在有上限的进程池中求解，并以 NDJSON 流逐行返回进度和结果。正在求解的
+相同任务会被合并，后到的请求直接订阅已有任务的进度和结果。
+
+接口：
+    POST /allocate   请求体为任务 JSON，响应为 NDJSON 事件流
+    GET  /health     服务状态
+
+任务 JSON：
+    {"allocations": {"甲": 200, "乙": 150},
+     "invoices": [["a 120.pdf", 120.0], ...]   或 "folder": "发票目录",
+     "recursive": false, "lower_bound": 0.97, "upper_bound": 1.03,
+     "method": "auto", "seed": 1, "time_budget": 5, "target_score": null}
+
+示例：
+    python service.py --port 8765 --workers 4
+    curl -N -d @job.json http://127.0.0.1:8765/allocate
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from InvoiceAllocator import InvoiceAllocator, SolverStats
+
+# 最多同时排队和运行的任务数，超过时返回 503
+MAX_PENDING_JOBS = 1000
+# 请求体大小上限（字节）
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+JOB_FIELDS = ("allocations", "invoices", "folder", "recursive", "lower_bound",
+              "upper_bound", "method", "seed", "time_budget", "target_score")
+
+
+def build_allocator(job):
+    """由任务 JSON 构造分配器，参数无效时抛出 ValueError"""
+    allocations = job.get("allocations")
+    if not isinstance(allocations, dict) or not allocations:
+        raise ValueError("allocations 必须是非空的 {人名: 额度} 对象")
+    allocator = InvoiceAllocator()
+    allocator.allocations = {str(name): float(quota) for name, quota in allocations.items()}
+    allocator.people = list(allocator.allocations)
+    allocator.lower_bound = float(job.get("lower_bound", allocator.lower_bound))
+    allocator.upper_bound = float(job.get("upper_bound", allocator.upper_bound))
+    if not 0 < allocator.lower_bound < 1 < allocator.upper_bound:
+        raise ValueError("上下限必须满足 0 < lower_bound < 1 < upper_bound")
+    if "invoices" in job:
+        allocator.invoices = [(str(name), float(amount)) for name, amount in job["invoices"]]
+    elif "folder" in job:
+        if not allocator.scan_invoices(job["folder"], recursive=bool(job.get("recursive"))):
+            raise ValueError(f"文件夹中没有发票: {job['folder']}")
+    else:
+        raise ValueError("需要提供 invoices 或 folder")
+    return allocator
+
+
+def solve_job(job, job_id=None, events=None):
+    """在工作进程中求解一个任务，进度事件放入 events 队列（为 None 时不发送）
+
+    统计会给每次得分计算加上计数开销，因此只在需要发送进度时开启，
+    此时结果中附带 stats。
+    """
+    def callback(event, data):
+        if event in ("progress", "best"):
+            events.put((job_id, event, data))
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            allocator = build_allocator(job)
+            if events is not None:
+                allocator.stats = SolverStats(callback)
+            allocation, amounts = allocator.find_optimal_allocation(
+                method=job.get("method", "auto"), seed=job.get("seed"),
+                time_budget=job.get("time_budget"), target_score=job.get("target_score"))
+    except Exception as e:
+        return {"event": "error", "message": str(e)}
+    if allocation is None:
+        return {"event": "result", "feasible": False, "allocation": None}
+    result = {
+        "event": "result",
+        "feasible": True,
+        "valid": allocator.is_valid_allocation(amounts),
+        "score": allocator.total_score(amounts),
+        "allocation": allocation,
+        "amounts": amounts,
+    }
+    if allocator.stats is not None:
+        result["stats"] = allocator.stats.to_dict()
+    return result
+
+
+def job_key(job):
+    """任务的规范键：参数完全相同的任务共享同一次求解"""
+    canonical = {field: job[field] for field in JOB_FIELDS if field in job}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Job:
+    """一个正在求解的任务及其订阅者"""
+
+    def __init__(self, key):
+        self.key = key
+        self.subscribers = []
+
+    def publish(self, message):
+        for queue in self.subscribers:
+            queue.put_nowait(message)
+
+
+class AllocationService:
+    """任务调度：进程池、进度转发和相同任务的合并"""
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        # 不能用 fork 创建工作进程：子进程会继承已打开的客户端连接，
+        # 使服务端关闭连接后客户端收不到 EOF
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self.manager = context.Manager()
+        self.events = self.manager.Queue()
+        self.jobs = {}
+        self.completed = 0
+        self.loop = None
+
+    def start(self, loop):
+        """启动转发工作进程进度事件的线程"""
+        self.loop = loop
+        threading.Thread(target=self.forward_events, daemon=True).start()
+
+    def forward_events(self):
+        while True:
+            item = self.events.get()
+            if item is None:
+                return
+            key, event, data = item
+            self.loop.call_soon_threadsafe(self.dispatch, key, {"event": event, **data})
+
+    def dispatch(self, key, message):
+        job = self.jobs.get(key)
+        if job is not None:
+            job.publish(message)
+
+    def subscribe(self, job):
+        """提交任务（相同的任务正在求解时直接合并），返回事件队列"""
+        key = job_key(job)
+        queue = asyncio.Queue()
+        running = self.jobs.get(key)
+        if running is not None:
+            running.subscribers.append(queue)
+            queue.put_nowait({"event": "accepted", "job": key, "coalesced": True})
+            return queue
+        if len(self.jobs) >= MAX_PENDING_JOBS:
+            return None
+
+        running = Job(key)
+        running.subscribers.append(queue)
+        self.jobs[key] = running
+        queue.put_nowait({"event": "accepted", "job": key, "coalesced": False})
+        future = self.loop.run_in_executor(self.pool, solve_job, job, key, self.events)
+        future.add_done_callback(lambda f: self.finish(running, f))
+        return queue
+
+    def finish(self, job, future):
+        self.jobs.pop(job.key, None)
+        self.completed += 1
+        try:
+            message = future.result()
+        except Exception as e:
+            message = {"event": "error", "message": str(e)}
+        job.publish(message)
+        job.publish(None)
+
+    def close(self):
+        self.events.put(None)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()
+
+
+async def read_request(reader):
+    """读取一个 HTTP 请求，返回 (方法, 路径, 请求体)"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("请求体过大")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, body
+
+
+async def send_json(writer, status, data):
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+    writer.write(body)
+    await writer.drain()
+
+
+async def stream_events(writer, queue):
+    """以 chunked 编码逐行发送 NDJSON 事件，直到任务结束"""
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n"
+                 b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+    while True:
+        message = await queue.get()
+        if message is None:
+            break
+        line = json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+        writer.write(f"{len(line):x}\r\n".encode("latin-1") + line + b"\r\n")
+        await writer.drain()
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+
+def make_handler(service):
+    async def handle(reader, writer):
+        try:
+            request = await read_request(reader)
+            if request is None:
+                return
+            method, path, body = request
+            if method == "GET" and path == "/health":
+                await send_json(writer, "200 OK", {
+                    "status": "ok", "workers": service.workers,
+                    "running": len(service.jobs), "completed": service.completed})
+            elif method == "POST" and path == "/allocate":
+                try:
+                    job = json.loads(body or b"{}")
+                    if not isinstance(job, dict):
+                        raise ValueError("任务必须是 JSON 对象")
+                except ValueError as e:
+                    await send_json(writer, "400 Bad Request", {"error": str(e)})
+                    return
+                queue = service.subscribe(job)
+                if queue is None:
+                    await send_json(writer, "503 Service Unavailable", {"error": "任务过多，请稍后重试"})
+                    return
+                await stream_events(writer, queue)
+            else:
+                await send_json(writer, "404 Not Found", {"error": "未知的接口"})
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            await send_json(writer, "400 Bad Request", {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(args):
+    loop = asyncio.get_running_loop()
+    service = AllocationService(args.workers)
+    service.start(loop)
+    handler = make_handler(service)
+    if args.unix:
+        server = await asyncio.start_unix_server(handler, path=args.unix)
+        where = args.unix
+    else:
+        server = await asyncio.start_server(handler, args.host, args.port)
+        where = f"http://{args.host}:{args.port}"
+    print(f"发票分配服务已启动: {where}（{service.workers} 个工作进程）")
+    # SIGTERM（如 docker stop、systemd）与 Ctrl-C 使用相同的关闭流程
+    stop = asyncio.Event()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except NotImplementedError:
+        # Windows 的事件循环不支持信号处理
+        pass
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        service.close()
+        await server.wait_closed()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="发票分配本地服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", help="监听 Unix 套接字而不是 TCP 端口")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数（默认使用全部 CPU）")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print()
+    print("服务已停止")
+
+
+if __name__ == "__main__":
+    main()